@@ -1,5 +1,4 @@
 from BatchProcessor import BatchProcessor
-import tiktoken
 import json
 import os
 from itertools import product
@@ -7,13 +6,28 @@ from itertools import product
 
 '''Abstraction that allows for generation of LLM experiments in various formats'''
 class BatchGenerator():
-    def __init__(self):
-        self.batch_processor = BatchProcessor()
-        self.enc = tiktoken.encoding_for_model("gpt-4o")
+    def __init__(self, batch_processor=None):
+        self._batch_processor = batch_processor
+        self._enc = None
+
+    @property
+    def batch_processor(self):
+        # Only create the OpenAI client when something needs it, so batch files can be written offline
+        if self._batch_processor is None:
+            self._batch_processor = BatchProcessor()
+        return self._batch_processor
+
+    @property
+    def enc(self):
+        # tiktoken is slow to import and may download the encoding, so only load it for token counts
+        if self._enc is None:
+            import tiktoken
+            self._enc = tiktoken.encoding_for_model("gpt-4o")
+        return self._enc
 
     
     def create_json_batch_file(self, filename, batch_messages, model="gpt-4o-mini", labels=[], max_tokens=10,
-                             temperature=0, seed=None, logprobs=True, top_logprobs=20):
+                             temperature=0, seed=None, logprobs=True, top_logprobs=20, result_store=None):
         """
         Creates a JSON batch file from message histories.
 
@@ -22,6 +36,11 @@ class BatchGenerator():
         - max_tokens (int): The maximum number of tokens.
         - messages (List[List[Dict]]): An array of message histories.
         - model (str): The model name.
+        - result_store (ResultStore, optional): If given, requests whose body is already in the store
+        are left out of the file, as are repeats of a body within the batch, and
+        '<filename>.manifest.json' records every custom_id in order so ResultStore.merge can rebuild
+        the full response file after fetching. If every request is in the store, only the manifest
+        is written.
 
         Returns:
         - bool: True if the file was created successfully, False otherwise.
@@ -35,43 +54,53 @@ class BatchGenerator():
             
             # Define the full file path
             file_path = os.path.join(directory, filename)
-            
+
+            manifest = []
+            n_hits = 0
+            n_repeats = 0
+            written_keys = set()
             with open(file_path, 'w', encoding='utf-8') as file:
                 for idx, messages in enumerate(batch_messages):
-                    # Construct the JSON object
-                    if idx <= len(labels): #If there are still labels to put in place
-                        json_object = {
-                            "custom_id": f"{labels[idx]}",
-                            "method": "POST",
-                            "url": "/v1/chat/completions",
-                            "body": {
-                                    "model": model,
-                                    "messages": messages,
-                                    "max_tokens": max_tokens,
-                                    "temperature": temperature,
-                                    "seed": seed,
-                                    "logprobs": logprobs,
-                                    "top_logprobs": top_logprobs,
-                                }
-                        }
-                    else:
-                        json_object = {
-                            "custom_id": f"request-{idx}",
-                            "method": "POST",
-                            "url": "/v1/chat/completions",
-                            "body": {
-                                    "model": model,
-                                    "messages": messages,
-                                    "max_tokens": max_tokens,
-                                    "temperature": temperature,
-                                    "seed": seed,
-                                    "logprobs": logprobs,
-                                    "top_logprobs": top_logprobs,
-                                }
-                        }
+                    # Use the label if there are still labels to put in place
+                    custom_id = f"{labels[idx]}" if idx < len(labels) else f"request-{idx}"
+                    json_object = {
+                        "custom_id": custom_id,
+                        "method": "POST",
+                        "url": "/v1/chat/completions",
+                        "body": {
+                                "model": model,
+                                "messages": messages,
+                                "max_tokens": max_tokens,
+                                "temperature": temperature,
+                                "seed": seed,
+                                "logprobs": logprobs,
+                                "top_logprobs": top_logprobs,
+                            }
+                    }
+
+                    if result_store is not None:
+                        key = result_store.key(json_object["body"])
+                        manifest.append((custom_id, key))
+                        if key in result_store:
+                            n_hits += 1
+                            continue
+                        # A body repeated within the batch is sent once, merge fans the result out
+                        if key in written_keys:
+                            n_repeats += 1
+                            continue
+                        written_keys.add(key)
                     
                     # Write the JSON object as a single line
                     file.write(json.dumps(json_object) + "\n")
+
+            if result_store is not None:
+                result_store.write_manifest(f"{file_path}.manifest.json", manifest)
+                print(f"Skipped {n_hits} of {len(manifest)} requests already in the result store "
+                      f"and {n_repeats} repeats within the batch")
+                if not written_keys:
+                    # Nothing left to send, so don't leave an empty batch file for sendbatch/runbatch to upload
+                    os.remove(file_path)
+                    print("No batch file written, run mergebatch to build the responses from the store")
             
             return True
         except Exception as e:
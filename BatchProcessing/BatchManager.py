@@ -0,0 +1,197 @@
+from BatchProcessor import BatchProcessor
+import asyncio
+import json
+import os
+import time
+
+
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+'''Runs the whole send -> poll -> fetch lifecycle for one or more batch files, with state kept on disk.'''
+class BatchManager():
+    def __init__(self, batch_processor=None, state_file="./Data/batch_state.json", max_concurrency=8,
+                 min_poll_interval=5, max_poll_interval=300, backoff=1.5, max_fetch_attempts=5):
+        self.batch_processor = batch_processor if batch_processor is not None else BatchProcessor()
+        self.state_file = state_file
+        self.max_concurrency = max_concurrency
+        self.min_poll_interval = min_poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.backoff = backoff
+        self.max_fetch_attempts = max_fetch_attempts
+        self.state = self.load_state()
+
+    def load_state(self):
+        """
+        Loads the tracked batches from the state file.
+
+        Returns:
+        - dict: Maps each batch file name to its 'batch_id', 'status' and 'output_file', plus 'fetched',
+        'fetch_attempts' and 'error_file' once the batch has finished.
+        """
+        if os.path.exists(self.state_file):
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        return {}
+
+    def save_state(self):
+        directory = os.path.dirname(self.state_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = self.state_file + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f, indent=4)
+        os.replace(temp_path, self.state_file)
+
+    def shard_batch_file(self, filename, max_requests=50000):
+        """
+        Splits a batch file in './Data/BatchFiles' into shards of at most max_requests lines.
+
+        Parameters:
+        - filename (str): The name of the batch file.
+        - max_requests (int): Maximum number of requests per shard.
+
+        Returns:
+        - list of str: The shard file names (just [filename] if it already fits).
+        """
+        directory = "./Data/BatchFiles"
+        with open(os.path.join(directory, filename), 'rb') as f:
+            n_lines = sum(1 for line in f if line.strip())
+        if n_lines <= max_requests:
+            return [filename]
+
+        stem, extension = os.path.splitext(filename)
+        shard_names = []
+        shard = None
+        count = 0
+        with open(os.path.join(directory, filename), 'rb') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                if count % max_requests == 0:
+                    if shard:
+                        shard.close()
+                    shard_names.append(f"{stem}_part{len(shard_names)}{extension}")
+                    shard = open(os.path.join(directory, shard_names[-1]), 'wb')
+                shard.write(line)
+                count += 1
+        shard.close()
+        print(f"Split {filename} into {len(shard_names)} shards")
+        return shard_names
+
+    async def _send(self, filename, description, semaphore):
+        async with semaphore:
+            meta_data = await asyncio.to_thread(self.batch_processor.send_batch_file, filename, description)
+        stem, extension = os.path.splitext(filename)
+        self.state[filename] = {
+            "batch_id": meta_data.id,
+            "status": meta_data.status,
+            "output_file": f"{stem}_response{extension}",
+        }
+        self.save_state()
+
+    async def _poll(self, filename, semaphore):
+        entry = self.state[filename]
+        try:
+            async with semaphore:
+                batch = await asyncio.to_thread(self.batch_processor.client.batches.retrieve, entry["batch_id"])
+        except Exception as e:
+            # Transient API errors (5xx, connection resets) count as a poll without changes, so backoff applies
+            print(f"{filename} ({entry['batch_id']}): error while polling: {e}")
+            return False
+        changed = batch.status != entry["status"]
+        entry["status"] = batch.status
+
+        if batch.status in TERMINAL_STATUSES and getattr(batch, "error_file_id", None) and "error_file" not in entry:
+            # Requests that failed are kept in the error file, e.g. when every request of a batch failed
+            stem, extension = os.path.splitext(filename)
+            async with semaphore:
+                fetched = await asyncio.to_thread(self.batch_processor.fetch_batch, entry["batch_id"],
+                                                  f"{stem}_errors{extension}", error_file=True)
+            entry["error_file"] = f"{stem}_errors{extension}" if fetched else None
+            changed = True
+
+        if batch.status == "completed" and not entry.get("fetched"):
+            if not getattr(batch, "output_file_id", None):
+                # Completed without a single successful request, so there is nothing to fetch
+                entry["fetched"] = False
+                entry["fetch_attempts"] = self.max_fetch_attempts
+                print(f"{filename} ({entry['batch_id']}): completed without an output file")
+                changed = True
+            else:
+                async with semaphore:
+                    entry["fetched"] = await asyncio.to_thread(self.batch_processor.fetch_batch, entry["batch_id"],
+                                                               entry["output_file"])
+                entry["fetch_attempts"] = entry.get("fetch_attempts", 0) + 1
+                # A failed download is retried with the usual backoff (it does not count as a change),
+                # up to max_fetch_attempts times
+                if not entry["fetched"] and entry["fetch_attempts"] >= self.max_fetch_attempts:
+                    print(f"{filename} ({entry['batch_id']}): giving up after {entry['fetch_attempts']} failed downloads")
+                self.save_state()
+                changed = changed or entry["fetched"]
+        if changed:
+            print(f"{filename} ({entry['batch_id']}): {batch.status}")
+            self.save_state()
+        return changed
+
+    def _pending(self, filenames):
+        return [filename for filename in filenames
+                if self.state[filename]["status"] not in TERMINAL_STATUSES
+                or (self.state[filename]["status"] == "completed" and not self.state[filename].get("fetched")
+                    and self.state[filename].get("fetch_attempts", 0) < self.max_fetch_attempts)]
+
+    async def run_async(self, filenames, description):
+        """
+        Uploads any batch files that are not tracked yet, then polls every tracked one until it
+        finishes and downloads outputs as soon as each batch completes.
+
+        Files already in the state file are not sent again, so an interrupted run picks up
+        where it stopped. Downloads that failed max_fetch_attempts times are given up on, and a
+        completed batch without an output file (every request failed) is not fetched at all; its
+        error file is saved as '<name>_errors.jsonl' instead. A rerun retries failed downloads.
+        The poll interval starts at min_poll_interval, grows by backoff while nothing changes, and
+        drops back to the minimum when any batch changes status.
+
+        Parameters:
+        - filenames (list of str): Batch files in './Data/BatchFiles'.
+        - description (str): Description attached to each new batch.
+
+        Returns:
+        - dict: The state entries for the given files.
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        for filename in filenames:
+            entry = self.state.get(filename)
+            if entry is not None and not entry.get("fetched") and entry.get("fetch_attempts", 0) >= self.max_fetch_attempts:
+                entry["fetch_attempts"] = 0
+
+        unsent = [filename for filename in filenames if filename not in self.state]
+        await asyncio.gather(*(self._send(filename, description, semaphore) for filename in unsent))
+
+        interval = self.min_poll_interval
+        pending = self._pending(filenames)
+        while pending:
+            start = time.monotonic()
+            changes = await asyncio.gather(*(self._poll(filename, semaphore) for filename in pending))
+            pending = self._pending(filenames)
+            if not pending:
+                break
+            interval = self.min_poll_interval if any(changes) else min(interval * self.backoff, self.max_poll_interval)
+            await asyncio.sleep(max(0, interval - (time.monotonic() - start)))
+
+        return {filename: self.state[filename] for filename in filenames}
+
+    def run(self, filename, description, max_requests=50000):
+        """
+        Shards a batch file if needed and runs all shards to completion.
+
+        Parameters:
+        - filename (str): The name of the batch file in './Data/BatchFiles'.
+        - description (str): Description of this batch.
+        - max_requests (int): Maximum number of requests per shard.
+
+        Returns:
+        - dict: The state entries for the shards.
+        """
+        shards = self.shard_batch_file(filename, max_requests=max_requests)
+        return asyncio.run(self.run_async(shards, description))
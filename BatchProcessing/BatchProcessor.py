@@ -1,10 +1,153 @@
 import json
 import os
-from openai import OpenAI
+import zlib
+from multiprocessing import Pool
+import numpy as np
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+
+def _parse_response_range(file_path, start, end, n_categories, top_k):
+    """
+    Parses the lines of a JSONL response file that begin inside the byte range [start, end).
+
+    A line belongs to the range its first byte falls in, so neighbouring ranges never
+    share or drop a line. Used directly for single-process parsing and as the
+    worker function for byte-range splits.
+
+    Returns:
+    - dict: Columnar NumPy arrays for this range ('categories', 'responses', 'tokens', 'logprobs').
+    """
+    categories = [[] for _ in range(n_categories)]
+    responses = []
+    tokens = []
+    logprobs = []
+
+    with open(file_path, 'rb') as f:
+        if start > 0:
+            f.seek(start - 1)
+            f.readline()  # Finish the line that straddles the range start
+        while f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+            if not line.strip():
+                continue
+            try:
+                data = _loads(line)
+            except ValueError:
+                continue
+
+            custom_id = data.get('custom_id')
+            if not custom_id:
+                continue
+
+            keys = [key.strip() for key in custom_id.split(' - ')]
+            keys = (keys + [''] * n_categories)[:n_categories]
+            for column, key in zip(categories, keys):
+                column.append(key)
+
+            try:
+                choice = data['response']['body']['choices'][0]
+            except (KeyError, IndexError, TypeError):
+                choice = {}
+
+            try:
+                responses.append(choice['message']['content'] or '')
+            except (KeyError, TypeError):
+                responses.append('')
+
+            row_tokens = [''] * top_k
+            row_logprobs = [np.nan] * top_k
+            try:
+                for i, lp in enumerate(choice['logprobs']['content'][0]['top_logprobs'][:top_k]):
+                    row_tokens[i] = lp.get('token') or ''
+                    row_logprobs[i] = lp.get('logprob', np.nan)
+            except (KeyError, IndexError, TypeError):
+                pass
+            tokens.append(row_tokens)
+            logprobs.append(row_logprobs)
+
+    return {
+        'categories': [np.array(column, dtype=str) for column in categories],
+        'responses': np.array(responses, dtype=str),
+        'tokens': np.array(tokens, dtype=str).reshape(-1, top_k),
+        'logprobs': np.array(logprobs, dtype=np.float32).reshape(-1, top_k),
+    }
+
+
+def _parse_response_range_star(args):
+    return _parse_response_range(*args)
+
+def _copy_range(infile, outfile, start, end, chunk_size=1024 * 1024):
+    infile.seek(start)
+    data = b''
+    while start < end:
+        data = infile.read(min(chunk_size, end - start))
+        if not data:
+            break
+        outfile.write(data)
+        start += len(data)
+    if data and not data.endswith(b'\n'):
+        outfile.write(b'\n')  # Last line of the file had no trailing newline
+
+
+class _StreamSink():
+    """
+    Receives downloaded chunks, optionally decompresses them into a file,
+    and hands complete lines to a callback.
+    """
+    def __init__(self, output_path=None, decompress=False, on_line=None):
+        self.decompressor = zlib.decompressobj(wbits=47) if decompress else None  # 47 = auto-detect gzip/zlib
+        self.output = open(output_path, 'wb') if output_path else None
+        self.on_line = on_line
+        self.buffer = b''
+        self.active = bool(self.decompressor or self.on_line)
+
+    def feed(self, chunk):
+        if self.decompressor:
+            chunk = self.decompressor.decompress(chunk)
+        self._emit(chunk)
+
+    def replay(self, path, chunk_size):
+        # Feed an already downloaded partial file so the decompressor and parser see the whole stream
+        if not self.active:
+            return
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                self.feed(chunk)
+
+    def _emit(self, data):
+        if self.output:
+            self.output.write(data)
+        if self.on_line and data:
+            lines = (self.buffer + data).split(b'\n')
+            self.buffer = lines.pop()
+            for line in lines:
+                if line.strip():
+                    self.on_line(line)
+
+    def close(self):
+        if self.decompressor:
+            self._emit(self.decompressor.flush())
+        if self.on_line and self.buffer.strip():
+            self.on_line(self.buffer)
+        self.buffer = b''
+        if self.output:
+            self.output.close()
+
 
 class BatchProcessor():
-    def __init__(self):
-        self.client = OpenAI()
+    def __init__(self, client=None):
+        # A client can be passed in to point at a different endpoint (e.g. a local fake for testing)
+        if client is None:
+            from openai import OpenAI  # Imported here since openai is slow to import
+            client = OpenAI()
+        self.client = client
 
     def send_batch_file(self, filename, description):
         """
@@ -39,27 +182,82 @@ class BatchProcessor():
         return meta_data
 
 
-    def fetch_batch(self, batch_id, output_file_name):
+    def fetch_batch(self, batch_id, output_file_name, chunk_size=1024 * 1024, resume=True, decompress=False,
+                    on_line=None, error_file=False):
+        """
+        Streams a batch's output file to disk instead of holding it in memory.
+
+        The download goes to '<output_file_name>.part' first. If that file exists from an
+        interrupted run, the download continues from its size with an HTTP range request
+        (or restarts if the server ignores the range). The finished file is checked against
+        the size reported by the files API before it is moved into place.
+
+        Parameters:
+        - batch_id (str): The ID of the batch to fetch.
+        - output_file_name (str): Name to save the response to inside './Data/ResponseFiles/'.
+        - chunk_size (int): Size of the chunks read from the response.
+        - resume (bool): Continue from an existing partial file.
+        - decompress (bool): Gunzip/inflate the stream while downloading and save the decompressed file.
+        - on_line (callable, optional): Called with every complete line (bytes) as soon as it arrives,
+        so response processing can start before the download finishes.
+        - error_file (bool): Fetch the batch's error file (the requests that failed) instead of its output file.
+
+        Returns:
+        - bool: True if the file was downloaded and verified, False otherwise.
+        """
+        output_file_path = f"./Data/ResponseFiles/{output_file_name}"
+        part_path = output_file_path + ".part"
+        sink = None
         try:
+            os.makedirs(os.path.dirname(output_file_path), exist_ok=True)
             # Retrieve the batch details
             batch_response = self.client.batches.retrieve(batch_id)
-            output_file_id = batch_response.output_file_id
+            output_file_id = batch_response.error_file_id if error_file else batch_response.output_file_id
 
             if not output_file_id:
-                raise ValueError(f"No output file associated with batch {batch_id}")
-
-            # Retrieve the output file content
-            file_response = self.client.files.content(output_file_id)
-            file_content = file_response.read()  # Read the binary content from the response
-
-            # Save the file content to a specified output file
-            output_file_path = f"./Data/ResponseFiles/{output_file_name}"
-            with open(output_file_path, 'wb') as f:
-                f.write(file_content)  # Write the binary data to the file
+                raise ValueError(f"No {'error' if error_file else 'output'} file associated with batch {batch_id}")
+
+            expected_size = getattr(self.client.files.retrieve(output_file_id), 'bytes', None)
+
+            offset = os.path.getsize(part_path) if resume and os.path.exists(part_path) else 0
+            if expected_size is not None and offset > expected_size:
+                offset = 0
+
+            sink = _StreamSink(output_file_path if decompress else None, decompress, on_line)
+
+            if expected_size is None or offset < expected_size:
+                headers = {"Range": f"bytes={offset}-"} if offset > 0 else None
+                with self.client.files.with_streaming_response.content(output_file_id, extra_headers=headers) as response:
+                    if offset > 0 and response.status_code != 206:
+                        # Server ignored the range and is sending the whole file, so start over
+                        offset = 0
+                    if offset > 0:
+                        sink.replay(part_path, chunk_size)
+                    with open(part_path, 'ab' if offset > 0 else 'wb') as f:
+                        for chunk in response.iter_bytes(chunk_size):
+                            f.write(chunk)
+                            sink.feed(chunk)
+            else:
+                sink.replay(part_path, chunk_size)
+            sink.close()
+
+            downloaded_size = os.path.getsize(part_path)
+            if expected_size is not None and downloaded_size != expected_size:
+                raise ValueError(f"Downloaded {downloaded_size} bytes but expected {expected_size}. "
+                                 f"Run again to resume from {part_path}")
+
+            if decompress:
+                os.remove(part_path)
+            else:
+                os.replace(part_path, output_file_path)
 
             print(f"Batch {batch_id} has been successfully saved to {output_file_path}.")
+            return True
         except Exception as e:
+            if sink is not None and sink.output:
+                sink.output.close()
             print(f"An error occurred while fetching batch {batch_id}: {e}")
+            return False
 
     def check_batch_status(self, batch_id):
         print(self.client.batches.retrieve(batch_id))
@@ -197,6 +395,131 @@ class BatchProcessor():
 
         return df
 
+    def response_to_arrays(self, response_file, category_labels=None, output_file=None, top_k=20,
+                           chunk_bytes=64 * 1024 * 1024, n_workers=1):
+        """
+        Streams a JSONL response file into columnar NumPy arrays instead of a list of dicts.
+
+        The file is parsed in byte-range chunks so only one chunk of parsed JSON is alive at
+        a time. With n_workers > 1 the chunks are parsed in parallel processes.
+
+        Parameters:
+        - response_file (str): The filename of the JSONL response file located in './Data/ResponseFiles/'.
+        - category_labels (list of str, optional): Labels for the ' - ' separated parts of 'custom_id'.
+        If not provided, the first line decides the number of categories and 'Category1', 'Category2', etc. are used.
+        - output_file (str, optional): If given, the columns are also saved to this path as a compressed .npz file.
+        - top_k (int): Width of the token/logprob matrices. Missing entries are '' and NaN.
+        - chunk_bytes (int): Approximate size of each byte-range split.
+        - n_workers (int): Number of processes used to parse the splits.
+
+        Returns:
+        - dict: One array per category label, plus 'Response', 'Tokens' (N x top_k) and 'Logprobs' (N x top_k float32).
+        """
+        file_path = f'./Data/ResponseFiles/{response_file}'
+
+        if category_labels is None:
+            with open(file_path, 'rb') as f:
+                first_line = f.readline()
+            if not first_line:
+                raise ValueError("The JSONL file is empty.")
+            n_categories = len(_loads(first_line).get('custom_id', '').split(' - '))
+            category_labels = [f'Category{i}' for i in range(1, n_categories + 1)]
+
+        file_size = os.path.getsize(file_path)
+        bounds = list(range(0, file_size, chunk_bytes)) + [file_size]
+        tasks = [(file_path, start, end, len(category_labels), top_k) for start, end in zip(bounds[:-1], bounds[1:])]
+
+        if n_workers > 1 and len(tasks) > 1:
+            with Pool(n_workers) as pool:
+                chunks = pool.map(_parse_response_range_star, tasks)
+        else:
+            chunks = map(_parse_response_range_star, tasks)
+
+        columns = {label: [] for label in category_labels}
+        columns['Response'] = []
+        columns['Tokens'] = []
+        columns['Logprobs'] = []
+        for chunk in chunks:
+            for label, column in zip(category_labels, chunk['categories']):
+                columns[label].append(column)
+            columns['Response'].append(chunk['responses'])
+            columns['Tokens'].append(chunk['tokens'])
+            columns['Logprobs'].append(chunk['logprobs'])
+
+        empty = {'Tokens': np.empty((0, top_k), dtype=str), 'Logprobs': np.empty((0, top_k), dtype=np.float32)}
+        arrays = {}
+        for name, parts in columns.items():
+            arrays[name] = np.concatenate(parts) if parts else empty.get(name, np.empty(0, dtype=str))
+
+        if output_file:
+            np.savez_compressed(output_file, **arrays)
+            print(f"Saved columnar responses to {output_file}")
+
+        return arrays
+
+    def response_to_tensor(self, response_file, category_labels=None, **kwargs):
+        """
+        Turns a response file into a dense logprob tensor instead of the nested dict from response_to_dict.
+
+        Axis i of the tensor indexes the unique values of the i-th ' - ' separated part of
+        'custom_id', and the last axis indexes the token vocabulary seen across all top logprobs.
+        Tokens outside a response's top logprobs are -inf; category combinations that are
+        not in the file are NaN.
+
+        Parameters:
+        - response_file (str): The filename of the JSONL response file located in './Data/ResponseFiles/'.
+        - category_labels (list of str, optional): Names for the category axes (see response_to_arrays).
+        - **kwargs: Passed on to response_to_arrays (top_k, chunk_bytes, n_workers).
+
+        Returns:
+        - tuple: (tensor, axes) where tensor is a float32 array of shape (*category sizes, vocabulary size)
+        and axes is a dict mapping each category label, then 'Token', to the labels along that axis.
+        """
+        arrays = self.response_to_arrays(response_file, category_labels=category_labels, **kwargs)
+        labels = [name for name in arrays if name not in ('Response', 'Tokens', 'Logprobs')]
+
+        axes = {}
+        indices = []
+        for label in labels:
+            axes[label], inverse = np.unique(arrays[label], return_inverse=True)
+            indices.append(inverse)
+
+        tokens = arrays['Tokens']
+        vocabulary, token_index = np.unique(tokens, return_inverse=True)
+        token_index = token_index.reshape(tokens.shape)
+        has_blank = vocabulary.size > 0 and vocabulary[0] == ''
+        if has_blank:
+            # Padding from rows with fewer than top_k logprobs is not a real token
+            vocabulary = vocabulary[1:]
+            token_index -= 1
+        axes['Token'] = vocabulary
+
+        shape = tuple(len(axes[label]) for label in labels)
+        tensor = np.full(shape + (len(vocabulary),), np.nan, dtype=np.float32)
+        tensor[tuple(indices)] = -np.inf
+
+        rows, cols = np.nonzero(token_index >= 0)
+        cell = tuple(index[rows] for index in indices)
+        tensor[cell + (token_index[rows, cols],)] = arrays['Logprobs'][rows, cols]
+
+        return tensor, axes
+
+    def marginalize_tensor(self, tensor, axes, keep):
+        """
+        Averages token probabilities over every category axis not listed in keep.
+
+        Parameters:
+        - tensor (np.ndarray): Logprob tensor from response_to_tensor.
+        - axes (dict): Axis labels from response_to_tensor.
+        - keep (list of str): Category labels to keep, e.g. ['Category3'] for a per-party distribution.
+
+        Returns:
+        - np.ndarray: Mean probabilities with shape (*kept category sizes, vocabulary size).
+        """
+        names = [name for name in axes if name != 'Token']
+        reduce_axes = tuple(i for i, name in enumerate(names) if name not in keep)
+        return np.nanmean(np.exp(tensor), axis=reduce_axes)
+
     def get_model(self, response_file):
         """
         Gets the model used
@@ -220,10 +543,121 @@ class BatchProcessor():
             except json.JSONDecodeError as e:
                 raise ValueError(f"Invalid JSON format in the first line: {e}")
     
+    def build_custom_id_index(self, jsonl_filename, rebuild=False):
+        """
+        Builds (or loads) a sidecar index of a JSONL file keyed by the ' - ' separated parts of 'custom_id'.
+
+        The index is saved next to the file as '<jsonl_filename>.idx.npz' and holds the byte offset
+        and length of every line plus, for each custom_id position, an integer code per line
+        into that position's sorted unique values (-1 where the line has no such part).
+        It is rebuilt automatically when the JSONL file's size or modification time changes.
+
+        Parameters:
+        - jsonl_filename (str): Path to the JSONL file.
+        - rebuild (bool): Force the index to be rebuilt.
+
+        Returns:
+        - dict: 'offsets', 'lengths', 'n_parts', and per position i 'codes{i}' and 'values{i}'.
+        """
+        index_path = jsonl_filename + '.idx.npz'
+        stat = os.stat(jsonl_filename)
+        signature = np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+        if not rebuild and os.path.exists(index_path):
+            with np.load(index_path) as cached:
+                if np.array_equal(cached['signature'], signature):
+                    return {name: cached[name] for name in cached.files}
+
+        offsets = []
+        lengths = []
+        parts_per_line = []
+        offset = 0
+        with open(jsonl_filename, 'rb') as f:
+            for line_number, line in enumerate(f, start=1):
+                line_length = len(line)
+                if line.strip():
+                    try:
+                        data = _loads(line)
+                    except ValueError as e:
+                        raise ValueError(f"Invalid JSON on line {line_number} of {jsonl_filename}: {e}")
+                    custom_id = data.get("custom_id", "")
+                    if custom_id:
+                        offsets.append(offset)
+                        lengths.append(line_length)
+                        parts_per_line.append([part.strip() for part in custom_id.split(" - ")])
+                offset += line_length
+
+        index = {
+            'signature': signature,
+            'offsets': np.array(offsets, dtype=np.int64),
+            'lengths': np.array(lengths, dtype=np.int64),
+            'n_parts': np.array([len(parts) for parts in parts_per_line], dtype=np.int32),
+        }
+        n_positions = int(index['n_parts'].max()) if parts_per_line else 0
+        for position in range(n_positions):
+            column = [parts[position] if position < len(parts) else None for parts in parts_per_line]
+            values = np.array(sorted({value for value in column if value is not None}), dtype=str)
+            lookup = {value: code for code, value in enumerate(values)}
+            index[f'values{position}'] = values
+            index[f'codes{position}'] = np.array([lookup.get(value, -1) for value in column], dtype=np.int32)
+
+        np.savez(index_path, **index)
+        return index
+
+    def filter_jsonl(self, new_filename, current_filename, filters, min_parts=0):
+        """
+        Copies the lines of a JSONL file whose custom_id matches every filter, using the sidecar index.
+
+        Matching lines are copied as raw byte ranges, so nothing is parsed or re-serialized.
+
+        Parameters:
+        - new_filename (str): The name of the output JSONL file.
+        - current_filename (str): The name of the input JSONL file.
+        - filters (dict): Maps a custom_id position (int) to the allowed values at that position.
+        - min_parts (int): Only keep lines whose custom_id has at least this many parts.
+
+        Returns:
+        - set: (position, value) pairs from filters that matched at least one line.
+        """
+        index = self.build_custom_id_index(current_filename)
+        mask = index['n_parts'] >= min_parts
+        allowed_codes = {}
+        for position, allowed in filters.items():
+            if f'values{position}' not in index:
+                mask[:] = False
+                continue
+            allowed_codes[position] = np.nonzero(np.isin(index[f'values{position}'], list(allowed)))[0]
+            mask &= np.isin(index[f'codes{position}'], allowed_codes[position])
+
+        found = set()
+        for position, codes in allowed_codes.items():
+            present = np.intersect1d(codes, index[f'codes{position}'][mask])
+            found.update((position, str(value)) for value in index[f'values{position}'][present])
+
+        offsets = index['offsets'][mask]
+        lengths = index['lengths'][mask]
+        with open(current_filename, 'rb') as infile, open(new_filename, 'wb') as outfile:
+            # Merge runs of adjacent lines into single reads
+            run_start, run_end = None, None
+            for offset, length in zip(offsets.tolist(), lengths.tolist()):
+                if run_end == offset:
+                    run_end += length
+                    continue
+                if run_start is not None:
+                    _copy_range(infile, outfile, run_start, run_end)
+                run_start, run_end = offset, offset + length
+            if run_start is not None:
+                _copy_range(infile, outfile, run_start, run_end)
+
+        return found
+
     def filter_candidates_jsonl(self, candidate1, candidate2, new_filename, current_filename):
         """
         Filters a JSONL file to include only entries for the specified candidates.
 
+        Uses the sidecar custom_id index (see build_custom_id_index), so repeated calls on the
+        same file only copy the matching lines.
+
         Parameters:
         - candidate1 (str): The first candidate's name.
         - candidate2 (str): The second candidate's name.
@@ -231,60 +665,23 @@ class BatchProcessor():
         - current_filename (str): The name of the input JSONL file.
 
         Raises:
-        - ValueError: If either candidate is not found in the input file.
+        - ValueError: If either candidate is not found in the input file, or a line is not valid JSON.
         - FileNotFoundError: If the input file does not exist.
-        - json.JSONDecodeError: If a line in the input file is not valid JSON.
         """
+        if not os.path.exists(current_filename):
+            raise FileNotFoundError(f"The file '{current_filename}' does not exist.")
 
-        # Initialize a set to track found candidates
-        found_candidates = set()
-
-        # List to store filtered JSON objects
-        filtered_entries = []
-
-        try:
-            with open(current_filename, 'r', encoding='utf-8') as infile:
-                for line_number, line in enumerate(infile, start=1):
-                    line = line.strip()
-                    if not line:
-                        continue  # Skip empty lines
-                    try:
-                        data = json.loads(line)
-                    except json.JSONDecodeError as e:
-                        raise json.JSONDecodeError(f"Invalid JSON on line {line_number}: {e.msg}", e.doc, e.pos)
-
-                    custom_id = data.get("custom_id", "")
-                    if not custom_id:
-                        continue  # Skip if custom_id is missing
-
-                    # Split the custom_id to extract the candidate name
-                    parts = custom_id.split(" - ")
-                    if len(parts) < 4:
-                        continue  # Skip if custom_id does not have enough parts
-
-                    candidate_name = parts[2].strip()
-
-                    if candidate_name == candidate1 or candidate_name == candidate2:
-                        filtered_entries.append(data)
-                        found_candidates.add(candidate_name)
-
-            # Check if both candidates were found
-            missing_candidates = {candidate1, candidate2} - found_candidates
-            if missing_candidates:
-                raise ValueError(f"Candidate(s) not found in the input file: {', '.join(missing_candidates)}")
-
-            # Write the filtered entries to the new JSONL file
-            with open(new_filename, 'w', encoding='utf-8') as outfile:
-                for entry in filtered_entries:
-                    json_line = json.dumps(entry)
-                    outfile.write(json_line + '\n')
+        # Candidate name is the third part of the custom_id, which needs at least four parts
+        found = self.filter_jsonl(new_filename, current_filename, {2: [candidate1, candidate2]}, min_parts=4)
+        found_candidates = {value for _, value in found}
 
-            print(f"Filtered JSONL file '{new_filename}' created successfully with candidates: {candidate1}, {candidate2}")
+        # Check if both candidates were found
+        missing_candidates = {candidate1, candidate2} - found_candidates
+        if missing_candidates:
+            os.remove(new_filename)
+            raise ValueError(f"Candidate(s) not found in the input file: {', '.join(missing_candidates)}")
 
-        except FileNotFoundError:
-            raise FileNotFoundError(f"The file '{current_filename}' does not exist.")
-        except Exception as e:
-            raise e
+        print(f"Filtered JSONL file '{new_filename}' created successfully with candidates: {candidate1}, {candidate2}")
 
     def cancel_batch(self, batch_id):
         """
@@ -1,20 +1,147 @@
+import hashlib
 import json
+import numbers
+import os
 from pathlib import Path
 import shutil  # New import for copying files
+import numpy as np
 
 
 '''Specialized file loader for use by the batch generator and processor files'''
 
-def save_analysis(foldername, win_distribution, result_distribution, result_str, jsonl_file_path=None):
+# Joins the keys of nested dicts into one array entry
+KEY_SEPARATOR = '\x1f'
+
+# JSONL files saved with an analysis are stored once under their SHA-256 here and linked into the folders
+OBJECT_DIR = Path('Analysis') / '.objects'
+
+
+def _flatten(dictionary, prefix=()):
+    for key, value in dictionary.items():
+        if isinstance(value, dict) and value:
+            yield from _flatten(value, prefix + (str(key),))
+        else:
+            yield prefix + (str(key),), value
+
+def _is_number(value_type):
+    return issubclass(value_type, numbers.Real) and not issubclass(value_type, (bool, np.bool_))
+
+def dict_to_arrays(dictionary):
+    """
+    Converts a (possibly nested) dict of numbers into a key array and a value array.
+
+    Parameters:
+    - dictionary (dict): E.g. a win or result distribution.
+
+    Returns:
+    - dict or None: {'keys': str array, 'values': number array}, plus an 'is_int' bool array when ints
+    and floats are mixed, so ints load as ints again. None if a value is not a number.
+    """
+    # Fast path for the common flat dict of numbers
+    types = set(map(type, dictionary.values()))
+    if all(_is_number(value_type) for value_type in types):
+        keys, values = list(map(str, dictionary)), list(dictionary.values())
+    else:
+        keys, values = [], []
+        for path, value in _flatten(dictionary):
+            if not _is_number(type(value)):
+                return None
+            keys.append(KEY_SEPARATOR.join(path))
+            values.append(value)
+        types = set(map(type, values))
+
+    arrays = {'keys': np.array(keys, dtype=str), 'values': np.array(values)}
+    if arrays['values'].dtype.kind == 'f' and any(issubclass(value_type, numbers.Integral) for value_type in types):
+        arrays['is_int'] = np.array([isinstance(value, numbers.Integral) for value in values])
+    return arrays
+
+def arrays_to_dict(keys, values, is_int=None):
+    values = values.tolist()
+    if is_int is not None:
+        for index in np.flatnonzero(is_int):
+            values[index] = int(values[index])
+    dictionary = {}
+    for key, value in zip(keys.tolist(), values):
+        *parents, leaf = key.split(KEY_SEPARATOR)
+        level = dictionary
+        for parent in parents:
+            level = level.setdefault(parent, {})
+        level[leaf] = value
+    return dictionary
+
+def _save_field(target_dir, name, dictionary, compress):
+    # Numeric dicts go to name.npz (compressed) or name/keys.npy + name/values.npy (memory-mappable),
+    # anything else to name.json. Whatever an earlier save left behind is removed first.
+    for path in (target_dir / f'{name}.json', target_dir / f'{name}.npz'):
+        if path.exists():
+            path.unlink()
+    if (target_dir / name).is_dir():
+        shutil.rmtree(target_dir / name)
+    arrays = dict_to_arrays(dictionary)
+    if arrays is None:
+        with (target_dir / f'{name}.json').open('w', encoding='utf-8') as f:
+            json.dump(dictionary, f)
+    elif compress:
+        np.savez_compressed(target_dir / f'{name}.npz', **arrays)
+    else:
+        (target_dir / name).mkdir(exist_ok=True)
+        for array_name, array in arrays.items():
+            np.save(target_dir / name / f'{array_name}.npy', array)
+
+def store_object(file_path):
+    """
+    Adds a file to the content-addressed object store.
+
+    The file is copied into OBJECT_DIR under its SHA-256 once, so saving the same file again costs
+    no space. The copy is never linked to the source, which may be rewritten later, and is made
+    read-only since analysis folders hardlink to it.
+
+    Parameters:
+    - file_path (str): The file to store.
+
+    Returns:
+    - Path: The stored object.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    object_path = OBJECT_DIR / digest.hexdigest()[:2] / (digest.hexdigest() + Path(file_path).suffix)
+    # Objects stored by hardlinking the source (as earlier versions did) are replaced by a copy
+    if not object_path.exists() or os.path.samefile(object_path, file_path):
+        object_path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = object_path.with_name(object_path.name + '.tmp')
+        if temp_path.exists():
+            temp_path.unlink()
+        shutil.copyfile(file_path, temp_path)
+        os.chmod(temp_path, 0o444)
+        os.replace(temp_path, object_path)
+    return object_path
+
+def _link_object(object_path, destination_path):
+    # Hardlink the object into the analysis folder, or leave a .ref file pointing at it
+    if destination_path.exists():
+        destination_path.unlink()
+    try:
+        os.link(object_path, destination_path)
+    except OSError:
+        with open(f'{destination_path}.ref', 'w', encoding='utf-8') as f:
+            f.write(str(object_path.resolve()))
+
+def save_analysis(foldername, win_distribution, result_distribution, result_str, jsonl_file_path=None, compress=True):
     """
     Saves two dictionaries, a result string, and optionally a JSONL file into specified files within a structured folder.
 
+    Numeric distributions are stored as key/value arrays (see dict_to_arrays) instead of JSON, and the
+    JSONL file is copied once into the store by content hash and hardlinked from there into the folder.
+
     Parameters:
     - foldername (str): Name of the subfolder inside 'Analysis'.
     - win_distribution (dict): Dictionary mapping states/parties to win percents.
     - result_distribution (dict): Dictionary mapping potential results to probabilities.
     - result_str (str): The string to write into 'results.txt'.
-    - jsonl_file_path (str, optional): Path to the JSONL file to be copied into the target folder.
+    - jsonl_file_path (str, optional): Path to the JSONL file to be linked into the target folder.
+    - compress (bool): Save distributions as compressed .npz, or as .npy files that load_analysis_field can memory-map.
     """
 
     # Define the base 'Analysis' directory
@@ -36,33 +163,72 @@ def save_analysis(foldername, win_distribution, result_distribution, result_str,
         raise
 
     # Define file paths
-    dict1_path = target_dir / 'win_distribution.json'
-    dict2_path = target_dir / 'result_distribution.json'
     results_path = target_dir / 'results.txt'
 
     try:
-        # Save dict1 as JSON
-        with dict1_path.open('w', encoding='utf-8') as f:
-            json.dump(win_distribution, f, indent=4)
-
-        # Save dict2 as JSON
-        with dict2_path.open('w', encoding='utf-8') as f:
-            json.dump(result_distribution, f, indent=4)
+        _save_field(target_dir, 'win_distribution', win_distribution, compress)
+        _save_field(target_dir, 'result_distribution', result_distribution, compress)
 
         # Save the result string
         with results_path.open('w', encoding='utf-8') as f:
             f.write(result_str)
 
-        # If a JSONL file path is provided, copy it into the target directory
+        # If a JSONL file path is provided, link it into the target directory
         if jsonl_file_path:
             jsonl_filename = Path(jsonl_file_path).name  # Get the filename from the provided path
             destination_path = target_dir / jsonl_filename
-            shutil.copy(jsonl_file_path, destination_path)
-            print(f"Copied JSONL file to '{destination_path}'.")
+            _link_object(store_object(jsonl_file_path), destination_path)
+            print(f"Linked JSONL file to '{destination_path}'.")
     except Exception as e:
         print(f"Error saving files: {e}")
         raise
 
+def load_analysis_field(foldername, name, as_arrays=False, mmap=False):
+    """
+    Loads one saved field of an analysis without touching the others.
+
+    Parameters:
+    - foldername (str): Name of the subfolder inside 'Analysis' to load data from.
+    - name (str): 'win_distribution' or 'result_distribution'.
+    - as_arrays (bool): Return the (keys, values) arrays instead of building a dict.
+    - mmap (bool): Memory-map the arrays (only for analyses saved with compress=False).
+
+    Returns:
+    - dict or tuple: The dictionary, or (keys, values) if as_arrays is True.
+    """
+    target_dir = Path('Analysis') / foldername
+    if (target_dir / f'{name}.npz').exists():
+        with np.load(target_dir / f'{name}.npz') as data:
+            keys, values = data['keys'], data['values']
+            is_int = data['is_int'] if 'is_int' in data.files else None
+    elif (target_dir / name).is_dir():
+        mmap_mode = 'r' if mmap else None
+        keys = np.load(target_dir / name / 'keys.npy', mmap_mode=mmap_mode)
+        values = np.load(target_dir / name / 'values.npy', mmap_mode=mmap_mode)
+        is_int_path = target_dir / name / 'is_int.npy'
+        is_int = np.load(is_int_path) if is_int_path.exists() else None
+    else:
+        # Non-numeric distributions and analyses saved before arrays were used
+        with (target_dir / f'{name}.json').open('r', encoding='utf-8') as f:
+            dictionary = json.load(f)
+        if not as_arrays:
+            return dictionary
+        arrays = dict_to_arrays(dictionary)
+        if arrays is None:
+            raise ValueError(f"{name} of '{foldername}' has non-numeric values")
+        return arrays['keys'], arrays['values']
+    return (keys, values) if as_arrays else arrays_to_dict(keys, values, is_int)
+
+def jsonl_path(foldername, jsonl_filename):
+    """
+    Returns the path of a JSONL file saved with an analysis, following .ref files to the object store.
+    """
+    path = Path('Analysis') / foldername / jsonl_filename
+    if not path.exists() and Path(f'{path}.ref').exists():
+        with open(f'{path}.ref', 'r', encoding='utf-8') as f:
+            return Path(f.read().strip())
+    return path
+
 def load_analysis(foldername):
     """
     Loads two dictionaries from specified files within a structured folder.
@@ -80,20 +246,12 @@ def load_analysis(foldername):
     # Define the target subfolder path
     target_dir = analysis_dir / foldername
 
-    # Define file paths
-    dict1_path = target_dir / 'win_distribution.json'
-    dict2_path = target_dir / 'result_distribution.json'
-
     try:
-        # Load dict1 from JSON
-        with dict1_path.open('r', encoding='utf-8') as f:
-            dict1 = json.load(f)
-        print(f"Loaded win_distribution from '{dict1_path}'.")
-
-        # Load dict2 from JSON
-        with dict2_path.open('r', encoding='utf-8') as f:
-            dict2 = json.load(f)
-        print(f"Loaded result_distribution from '{dict2_path}'.")
+        dict1 = load_analysis_field(foldername, 'win_distribution')
+        print(f"Loaded win_distribution from '{target_dir}'.")
+
+        dict2 = load_analysis_field(foldername, 'result_distribution')
+        print(f"Loaded result_distribution from '{target_dir}'.")
 
         return dict1, dict2
     except FileNotFoundError as fnf_error:
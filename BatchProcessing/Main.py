@@ -1,29 +1,41 @@
 from BatchProcessor import BatchProcessor
 from BatchGenerator import BatchGenerator
+from BatchManager import BatchManager
+from ResultStore import ResultStore
 
 import argparse
 import os
 
-def genbatch(gen_method, filename, max_tokens=100, model='gpt-4o-mini'):
+client = None  # OpenAI client for every BatchProcessor, replaced by --record / --replay
+
+def genbatch(gen_method, filename, max_tokens=100, model='gpt-4o-mini', dedup=False):
     batch_generator = BatchGenerator()
     if hasattr(batch_generator, gen_method):
         method_to_call = getattr(batch_generator, gen_method)
         batch_messages, labels = method_to_call()
-        if batch_generator.create_json_batch_file(filename=f"{filename}", batch_messages=batch_messages, labels=labels, max_tokens=max_tokens, model=model):
+        result_store = ResultStore() if dedup else None
+        if batch_generator.create_json_batch_file(filename=f"{filename}", batch_messages=batch_messages, labels=labels, max_tokens=max_tokens, model=model, result_store=result_store) \
+                and os.path.exists(f'./Data/BatchFiles/{filename}'):
             print(f"Created batchfile at ./BatchFiles/{filename}")
     else:
         print(f"Method '{gen_method}' not found.")
     
 
+def _print_missing_batch_file(file_name):
+    if os.path.exists(f'./Data/BatchFiles/{file_name}.manifest.json'):
+        print(f'Nothing to send: every request of {file_name} is in the result store, run mergebatch instead')
+    else:
+        print(f'./Data/BatchFiles/{file_name} not found')
+
 def sendbatch(file_name, description):
-    batch_processor = BatchProcessor()
+    batch_processor = BatchProcessor(client)
     if os.path.exists(f'./Data/BatchFiles/{file_name}'):
         meta_data = batch_processor.send_batch_file(file_name, description)
     else:
-        print(f'./Data/BatchFiles/{file_name} not found')
+        _print_missing_batch_file(file_name)
 
 def checkbatch(batch_id="all"):
-    batch_processor = BatchProcessor()
+    batch_processor = BatchProcessor(client)
     if batch_id == "all":
         batch_processor.check_all_batch_status()
     else:
@@ -41,14 +53,59 @@ def getbatch(batch_id, file_name):
     Returns:
     - None: The result is saved to a file.
     """
-    batch_processor = BatchProcessor()
+    batch_processor = BatchProcessor(client)
     batch_processor.fetch_batch(batch_id, file_name)
 
 
+def mergebatch(batch_file_name, response_file_name, output_file_name):
+    """
+    Adds a fetched deduplicated batch to the result store and writes the full response file.
+
+    Parameters:
+    - batch_file_name (str): The batch file created with genbatch --dedup.
+    - response_file_name (str): The fetched response file (may not exist if every request was a store hit).
+    - output_file_name (str): Name of the merged response file, in the original custom_id order.
+
+    Returns:
+    - None: The result is saved to './Data/ResponseFiles'.
+    """
+    result_store = ResultStore()
+    batch_file_path = f'./Data/BatchFiles/{batch_file_name}'
+    response_file_path = f'./Data/ResponseFiles/{response_file_name}'
+    if os.path.exists(response_file_path):
+        added = result_store.add_responses(batch_file_path, response_file_path)
+        print(f"Added {added} responses to the result store")
+    missing = result_store.merge(f'{batch_file_path}.manifest.json', f'./Data/ResponseFiles/{output_file_name}')
+    if missing:
+        print(f"{len(missing)} requests have no stored result, e.g. {missing[0]}")
+    print(f"Merged responses saved to ./Data/ResponseFiles/{output_file_name}")
+
+
+def runbatch(file_name, description, max_requests=50000, state_file="./Data/batch_state.json"):
+    """
+    Sends a batch file (split into shards if needed), waits for every shard and downloads the results.
+
+    Parameters:
+    - file_name (str): The name of the batch file in './Data/BatchFiles'.
+    - description (str): Description of the batch.
+    - max_requests (int): Maximum number of requests per shard.
+    - state_file (str): JSON file tracking batch IDs, so an interrupted run can be resumed.
+
+    Returns:
+    - None: The results are saved to './Data/ResponseFiles'.
+    """
+    if not os.path.exists(f'./Data/BatchFiles/{file_name}'):
+        _print_missing_batch_file(file_name)
+        return
+    batch_manager = BatchManager(BatchProcessor(client), state_file=state_file)
+    batch_manager.run(file_name, description, max_requests=max_requests)
 
 
 def main():
     parser = argparse.ArgumentParser(description="Batch Processing Program")
+    parser.add_argument('--record', type=str, default=None, help="Record every API call to this file")
+    parser.add_argument('--replay', type=str, default=None, help="Answer API calls from this recording instead of the API")
+    parser.add_argument('--replay_latency', type=str, default=None, help="Delay per replayed call: seconds or 'recorded'")
     subparsers = parser.add_subparsers(dest="command")
 
     # genbatch command
@@ -57,6 +114,7 @@ def main():
     genbatch_parser.add_argument('file_name', type=str, help="The name of the batch file to generate. Do not include file extension.")
     genbatch_parser.add_argument('--model', type=str, default='gpt-4o-mini', help="Model to use (default gpt-4o-mini)")
     genbatch_parser.add_argument('--max_tokens', type=int, default=100, help="Max output tokens (default is 100)")
+    genbatch_parser.add_argument('--dedup', action='store_true', help="Leave out requests already in the result store")
 
     # sendbatch command
     sendbatch_parser = subparsers.add_parser('sendbatch', help="Send a batch file")
@@ -72,23 +130,54 @@ def main():
     getbatch_parser.add_argument('batch_id', type=str, help="The ID of the batch to fetch")
     getbatch_parser.add_argument('file_name', type=str, help="Name to save batch response to")
 
+    # mergebatch command
+    mergebatch_parser = subparsers.add_parser('mergebatch', help="Merge a deduplicated batch with the result store")
+    mergebatch_parser.add_argument('batch_file_name', type=str, help="The batch file that was generated with --dedup")
+    mergebatch_parser.add_argument('response_file_name', type=str, help="The fetched response file")
+    mergebatch_parser.add_argument('output_file_name', type=str, help="Name to save the merged responses to")
+
+    # runbatch command
+    runbatch_parser = subparsers.add_parser('runbatch', help="Send a batch file, wait for it and fetch the results")
+    runbatch_parser.add_argument('file_name', type=str, help="The name of the batch file to send")
+    runbatch_parser.add_argument('--desc', type=str, default="LLM voting batch file", help="Description of batch file")
+    runbatch_parser.add_argument('--max_requests', type=int, default=50000, help="Max requests per shard (default is 50000)")
+    runbatch_parser.add_argument('--state_file', type=str, default="./Data/batch_state.json", help="File tracking sent batches")
 
     # target_party, jsonl, k=10000, iteration='0', verbose=False
 
     # Parse arguments
     args = parser.parse_args()
 
+    global client
+    if args.replay:
+        from ReplayClient import ReplayClient
+        latency = args.replay_latency
+        if latency is not None and latency != 'recorded':
+            latency = float(latency)
+        client = ReplayClient(args.replay, latency=latency)
+    elif args.record:
+        from ReplayClient import RecordingClient
+        from openai import OpenAI
+        client = RecordingClient(OpenAI(), args.record)
+
     # Dispatch to the appropriate function
     if args.command == "genbatch":
-        genbatch(args.gen_method, args.file_name, args.max_tokens, args.model)
+        genbatch(args.gen_method, args.file_name, args.max_tokens, args.model, args.dedup)
     elif args.command == "sendbatch":
         sendbatch(args.file_name, args.desc)
     elif args.command == "checkbatch":
         checkbatch(args.batch_id)
     elif args.command == "getbatch":
         getbatch(args.batch_id, args.file_name)
+    elif args.command == "mergebatch":
+        mergebatch(args.batch_file_name, args.response_file_name, args.output_file_name)
+    elif args.command == "runbatch":
+        runbatch(args.file_name, args.desc, args.max_requests, args.state_file)
     else:
         parser.print_help()
 
+    if client is not None:
+        client.close()
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
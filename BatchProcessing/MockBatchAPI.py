@@ -0,0 +1,154 @@
+import itertools
+import json
+from collections import Counter
+from types import SimpleNamespace
+
+
+def echo_responder(body):
+    # Default reply: the last user message, so results can be matched to their requests
+    return body["messages"][-1]["content"]
+
+
+class _Stream():
+    '''Stand-in for files.with_streaming_response.content(...), honouring Range headers like the real API.'''
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def iter_bytes(self, chunk_size=None):
+        chunk_size = chunk_size or len(self.content) or 1
+        for start in range(0, len(self.content), chunk_size):
+            yield self.content[start:start + chunk_size]
+
+
+class _Files():
+    def __init__(self, api):
+        self.api = api
+        self.with_streaming_response = SimpleNamespace(content=self._stream)
+
+    def create(self, file, purpose):
+        self.api.calls["files.create"] += 1
+        content = file.read()
+        file.close()
+        return self.api._add_file(content)
+
+    def retrieve(self, file_id):
+        self.api.calls["files.retrieve"] += 1
+        return SimpleNamespace(id=file_id, bytes=len(self.api.file_contents[file_id]))
+
+    def content(self, file_id):
+        self.api.calls["files.content"] += 1
+        content = self.api.file_contents[file_id]
+        return SimpleNamespace(content=content, text=content.decode('utf-8'))
+
+    def _stream(self, file_id, extra_headers=None):
+        self.api.calls["files.stream"] += 1
+        if self.api.fetch_failures > 0:
+            self.api.fetch_failures -= 1
+            raise ConnectionError("Mock download failure")
+        content = self.api.file_contents[file_id]
+        if extra_headers and "Range" in extra_headers and self.api.honor_range:
+            offset = int(extra_headers["Range"].split("=")[1].rstrip("-"))
+            return _Stream(206, content[offset:])
+        return _Stream(200, content)
+
+
+class _Batches():
+    def __init__(self, api):
+        self.api = api
+
+    def create(self, input_file_id, endpoint, completion_window, metadata=None):
+        self.api.calls["batches.create"] += 1
+        batch_id = f"batch_{next(self.api.ids)}"
+        self.api.batch_records[batch_id] = {"input_file_id": input_file_id, "status": "validating", "polls": 0,
+                                            "output_file_id": None, "error_file_id": None, "metadata": metadata}
+        return self._view(batch_id)
+
+    def retrieve(self, batch_id):
+        self.api.calls["batches.retrieve"] += 1
+        if self.api.retrieve_failures > 0:
+            self.api.retrieve_failures -= 1
+            raise ConnectionError("Mock retrieve failure")
+        batch = self.api.batch_records[batch_id]
+        batch["polls"] += 1
+        if batch["status"] == "validating":
+            batch["status"] = "in_progress"
+        elif batch["status"] == "in_progress" and batch["polls"] > self.api.polls_to_complete:
+            self.api._complete(batch)
+        return self._view(batch_id)
+
+    def list(self, limit=10):
+        self.api.calls["batches.list"] += 1
+        return [self._view(batch_id) for batch_id in list(self.api.batch_records)[-limit:]]
+
+    def cancel(self, batch_id):
+        self.api.calls["batches.cancel"] += 1
+        self.api.batch_records[batch_id]["status"] = "cancelled"
+        return self._view(batch_id)
+
+    def _view(self, batch_id):
+        batch = self.api.batch_records[batch_id]
+        return SimpleNamespace(id=batch_id, status=batch["status"], input_file_id=batch["input_file_id"],
+                               output_file_id=batch["output_file_id"], error_file_id=batch["error_file_id"],
+                               metadata=batch["metadata"])
+
+
+'''In-memory fake of the OpenAI files and batches APIs, for running the batch tools end to end offline.'''
+class MockBatchClient():
+    def __init__(self, responder=echo_responder, polls_to_complete=2, fail=lambda request: False, fetch_failures=0,
+                 retrieve_failures=0, honor_range=True):
+        """
+        Parameters:
+        - responder (callable): Maps a request body to the message content of its response.
+        - polls_to_complete (int): Number of batches.retrieve calls before a batch completes.
+        - fail (callable): Returns True for requests that should fail. When all requests of a batch
+        fail it completes with only an error file, like the real API.
+        - fetch_failures (int): Number of output downloads that raise before downloads succeed.
+        - retrieve_failures (int): Number of batches.retrieve calls that raise before they succeed.
+        - honor_range (bool): Answer Range requests with 206 and the rest of the file. If False, the
+        whole file is sent with 200, like servers without range support.
+        """
+        self.responder = responder
+        self.polls_to_complete = polls_to_complete
+        self.fail = fail
+        self.fetch_failures = fetch_failures
+        self.retrieve_failures = retrieve_failures
+        self.honor_range = honor_range
+        self.file_contents = {}
+        self.batch_records = {}
+        self.ids = itertools.count()
+        self.calls = Counter()  # Number of calls per API method
+        self.files = _Files(self)
+        self.batches = _Batches(self)
+
+    def _add_file(self, content):
+        file_id = f"file_{next(self.ids)}"
+        self.file_contents[file_id] = content
+        return SimpleNamespace(id=file_id, bytes=len(content))
+
+    def _complete(self, batch):
+        outputs, errors = [], []
+        for line in self.file_contents[batch["input_file_id"]].decode('utf-8').splitlines():
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            if self.fail(request):
+                errors.append({"id": f"req_{next(self.ids)}", "custom_id": request["custom_id"], "response": None,
+                               "error": {"code": "mock_error", "message": "Request failed"}})
+                continue
+            content = self.responder(request["body"])
+            outputs.append({"id": f"req_{next(self.ids)}", "custom_id": request["custom_id"], "error": None,
+                            "response": {"status_code": 200, "body": {
+                                "model": request["body"].get("model"),
+                                "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                                             "logprobs": None, "finish_reason": "stop"}]}}})
+        encode = lambda records: "".join(json.dumps(record) + "\n" for record in records).encode('utf-8')
+        batch["output_file_id"] = self._add_file(encode(outputs)).id if outputs else None
+        batch["error_file_id"] = self._add_file(encode(errors)).id if errors else None
+        batch["status"] = "completed"
@@ -0,0 +1,304 @@
+import base64
+import hashlib
+import json
+import os
+import random
+import struct
+import threading
+import time
+import zlib
+
+
+_LENGTH = struct.Struct('<I')
+
+
+def _encode_argument(value):
+    # Files are keyed on their content, anything else that is not JSON on its repr
+    if hasattr(value, 'read') and hasattr(value, 'seek'):
+        position = value.tell()
+        digest = hashlib.sha256(value.read()).hexdigest()
+        value.seek(position)
+        return {"file_sha256": digest}
+    if isinstance(value, bytes):
+        return {"bytes_sha256": hashlib.sha256(value).hexdigest()}
+    return repr(value)
+
+def request_key(method, args, kwargs):
+    """
+    Hashes one client call into the key its responses are stored under.
+
+    Parameters:
+    - method (str): Dotted path of the client method, e.g. 'chat.completions.create'.
+    - args (tuple): Positional arguments of the call.
+    - kwargs (dict): Keyword arguments of the call.
+
+    Returns:
+    - str: Hex SHA-256 of the canonical JSON encoding of the call.
+    """
+    canonical = json.dumps({"method": method, "args": list(args), "kwargs": kwargs}, sort_keys=True,
+                           separators=(',', ':'), ensure_ascii=False, default=_encode_argument)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+def _to_json(value):
+    # OpenAI responses are pydantic models; pages and plain objects fall back to their attributes
+    if hasattr(value, 'model_dump'):
+        return value.model_dump(mode='json')
+    if isinstance(value, (list, tuple)):
+        return [_to_json(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _to_json(item) for key, item in value.items()}
+    if hasattr(value, '__dict__'):
+        return {key: _to_json(item) for key, item in vars(value).items() if not key.startswith('_')}
+    return value
+
+
+class ReplayedObject():
+    '''Read-only stand-in for a recorded response, with attribute access like the real objects.'''
+    def __init__(self, data):
+        self._data = data
+
+    def __getattr__(self, name):
+        try:
+            return _wrap(self._data[name])
+        except KeyError:
+            raise AttributeError(name)
+
+    def __getitem__(self, name):
+        return _wrap(self._data[name])
+
+    def __iter__(self):
+        return iter(_wrap(self._data.get('data', [])))
+
+    def model_dump(self, mode=None):
+        return self._data
+
+    def __repr__(self):
+        return f"ReplayedObject({self._data!r})"
+
+def _wrap(value):
+    if isinstance(value, dict):
+        return ReplayedObject(value)
+    if isinstance(value, list):
+        return [_wrap(item) for item in value]
+    return value
+
+
+class _ReplayedStream():
+    '''Stand-in for files.with_streaming_response.content(...) that yields the recorded bytes.'''
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def iter_bytes(self, chunk_size=None):
+        chunk_size = chunk_size or len(self.content) or 1
+        for start in range(0, len(self.content), chunk_size):
+            yield self.content[start:start + chunk_size]
+
+
+class _RecordingStream():
+    '''Wraps a streaming response and hands the full body to on_close once it was read completely.'''
+    def __init__(self, manager, on_close):
+        self.manager = manager
+        self.on_close = on_close
+        self.response = None
+        self.chunks = []
+
+    def __enter__(self):
+        self.response = self.manager.__enter__()
+        return self
+
+    @property
+    def status_code(self):
+        return self.response.status_code
+
+    def iter_bytes(self, chunk_size=None):
+        for chunk in self.response.iter_bytes(chunk_size):
+            self.chunks.append(chunk)
+            yield chunk
+
+    def __exit__(self, *exc_info):
+        result = self.manager.__exit__(*exc_info)
+        if exc_info[0] is None:
+            self.on_close(self.response.status_code, b''.join(self.chunks))
+        return result
+
+
+class _ClientPath():
+    '''Collects attribute accesses (client.chat.completions.create) and sends the call to a handler.'''
+    def __init__(self, handler, path=()):
+        self._handler = handler
+        self._path = path
+
+    def __getattr__(self, name):
+        return _ClientPath(self._handler, self._path + (name,))
+
+    def __call__(self, *args, **kwargs):
+        return self._handler('.'.join(self._path), args, kwargs)
+
+
+'''Append-only file of recorded calls with an index from request key to record positions.'''
+class ReplayFile():
+    def __init__(self, path):
+        self.path = path
+        self.index_path = path + ".idx"
+        self.lock = threading.Lock()
+        self.index = self.load_index()
+
+    def load_index(self):
+        """
+        Loads the index, or rebuilds it by scanning the records if it is missing or out of date
+        (e.g. after a recording process was killed before close()).
+
+        Returns:
+        - dict: Maps each request key to a list of (offset, length) of its records, in recording order.
+        """
+        if not os.path.exists(self.path):
+            return {}
+        size = os.path.getsize(self.path)
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+            if saved.get('size') == size:
+                return saved['index']
+
+        index = {}
+        with open(self.path, 'rb') as f:
+            offset = 0
+            while offset + _LENGTH.size <= size:
+                (length,) = _LENGTH.unpack(f.read(_LENGTH.size))
+                record = self._decode(f.read(length))
+                index.setdefault(record['key'], []).append((offset, length))
+                offset += _LENGTH.size + length
+        return index
+
+    def save_index(self):
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        temp_path = self.index_path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({'size': size, 'index': self.index}, f)
+        os.replace(temp_path, self.index_path)
+
+    @staticmethod
+    def _decode(data):
+        return json.loads(zlib.decompress(data))
+
+    def append(self, record):
+        data = zlib.compress(json.dumps(record, separators=(',', ':')).encode('utf-8'))
+        with self.lock:
+            with open(self.path, 'ab') as f:
+                offset = f.tell()
+                f.write(_LENGTH.pack(len(data)) + data)
+            self.index.setdefault(record['key'], []).append((offset, len(data)))
+
+    def read(self, key, n):
+        offset, length = self.index[key][n]
+        with open(self.path, 'rb') as f:
+            f.seek(offset + _LENGTH.size)
+            return self._decode(f.read(length))
+
+
+'''Passes every call through to a real client and records the request -> response pairs.'''
+class RecordingClient():
+    def __init__(self, client, path):
+        self._client = client
+        self._file = ReplayFile(path)
+
+    def __getattr__(self, name):
+        return getattr(_ClientPath(self._call), name)
+
+    def _call(self, method, args, kwargs):
+        target = self._client
+        for name in method.split('.'):
+            target = getattr(target, name)
+        key = request_key(method, args, kwargs)
+        start = time.perf_counter()
+        result = target(*args, **kwargs)
+        if 'with_streaming_response' in method:
+            def on_close(status_code, content):
+                self._file.append({'key': key, 'method': method, 'latency': time.perf_counter() - start,
+                                   'status_code': status_code, 'content': base64.b64encode(content).decode('ascii')})
+            return _RecordingStream(result, on_close)
+        self._file.append({'key': key, 'method': method, 'latency': time.perf_counter() - start,
+                           'response': _to_json(result)})
+        return result
+
+    def close(self):
+        self._file.save_index()
+
+
+'''Answers calls from a recording made with RecordingClient, so runs need no network access.'''
+class ReplayClient():
+    def __init__(self, path, latency=None, seed=None, fallback=None):
+        """
+        Parameters:
+        - path (str): Recording written by RecordingClient.
+        - latency: Synthetic delay per call. None for no delay, 'recorded' for the recorded latency,
+        a number for a constant delay in seconds, or a callable (rng, recorded_latency) -> seconds,
+        e.g. lognormal_latency(0.8, 0.5).
+        - seed (int, optional): Seed for the latency draws.
+        - fallback (RecordingClient, optional): Client for calls that were never recorded; they are
+        recorded on the way. Without it an unrecorded call raises KeyError.
+        """
+        self._file = ReplayFile(path)
+        self._latency = latency
+        self._rng = random.Random(seed)
+        self._fallback = fallback
+        self._served = {}
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(_ClientPath(self._call), name)
+
+    def _delay(self, recorded_latency):
+        if self._latency is None:
+            return 0
+        if self._latency == 'recorded':
+            return recorded_latency
+        if callable(self._latency):
+            return self._latency(self._rng, recorded_latency)
+        return self._latency
+
+    def _call(self, method, args, kwargs):
+        key = request_key(method, args, kwargs)
+        with self._lock:
+            records = self._file.index.get(key)
+            if not records:
+                if self._fallback is None:
+                    raise KeyError(f"No recorded response for {method} (key {key})")
+                return self._fallback._call(method, args, kwargs)
+            # Repeated identical calls get the recorded responses in order, then start over
+            n = self._served.get(key, 0)
+            self._served[key] = n + 1
+        record = self._file.read(key, n % len(records))
+
+        delay = self._delay(record['latency'])
+        if delay > 0:
+            time.sleep(delay)
+        if 'content' in record:
+            return _ReplayedStream(record['status_code'], base64.b64decode(record['content']))
+        return _wrap(record['response'])
+
+    def close(self):
+        # Defined here since __getattr__ would treat close() as a recorded call
+        if self._fallback is not None:
+            self._fallback.close()
+
+
+def lognormal_latency(median, sigma):
+    """
+    Latency model for ReplayClient with a log-normal distribution, which fits API latencies well.
+
+    Parameters:
+    - median (float): Median delay in seconds.
+    - sigma (float): Standard deviation of the log delay.
+
+    Returns:
+    - callable: (rng, recorded_latency) -> seconds.
+    """
+    return lambda rng, recorded_latency: rng.lognormvariate(0, sigma) * median
@@ -0,0 +1,116 @@
+import hashlib
+import json
+import os
+
+
+'''Content-addressed store of batch results, so identical requests are only ever sent once.'''
+class ResultStore():
+    def __init__(self, directory="./Data/ResultStore"):
+        self.directory = directory
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def key(body):
+        """
+        Hashes a request body (model, messages, temperature, seed, max_tokens, ...) into a store key.
+
+        Note that requests with temperature > 0 and no seed are still treated as identical.
+
+        Parameters:
+        - body (dict): The 'body' of a batch request.
+
+        Returns:
+        - str: Hex SHA-256 of the canonical JSON encoding of the body.
+        """
+        canonical = json.dumps(body, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def __contains__(self, key):
+        return os.path.exists(self._path(key))
+
+    def get(self, key):
+        with open(self._path(key), 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def put(self, key, result):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(result, f)
+        os.replace(temp_path, path)
+
+    def write_manifest(self, manifest_path, entries):
+        """
+        Saves the full request list of a batch as (custom_id, key) pairs in the original order.
+
+        Parameters:
+        - manifest_path (str): Where to write the manifest.
+        - entries (list of tuple): (custom_id, key) for every request, including store hits.
+        """
+        with open(manifest_path, 'w', encoding='utf-8') as f:
+            json.dump([list(entry) for entry in entries], f)
+
+    def add_responses(self, batch_file_path, response_file_path):
+        """
+        Stores every successful response of a fetched batch under the key of its request body.
+
+        Parameters:
+        - batch_file_path (str): The batch JSONL file that was sent.
+        - response_file_path (str): The fetched response JSONL file.
+
+        Returns:
+        - int: Number of responses added to the store.
+        """
+        keys = {}
+        with open(batch_file_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    request = json.loads(line)
+                    keys[request['custom_id']] = self.key(request['body'])
+
+        added = 0
+        with open(response_file_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                data = json.loads(line)
+                key = keys.get(data.get('custom_id'))
+                response = data.get('response') or {}
+                if key is None or data.get('error') or response.get('status_code', 200) != 200:
+                    continue
+                result = {name: value for name, value in data.items() if name != 'custom_id'}
+                self.put(key, result)
+                added += 1
+        return added
+
+    def merge(self, manifest_path, output_file_path):
+        """
+        Writes a complete response file for a deduplicated batch, in the original custom_id order.
+
+        Every response is read from the store, so add_responses must be called for the
+        fetched batch first.
+
+        Parameters:
+        - manifest_path (str): Manifest written when the batch file was created.
+        - output_file_path (str): Where to write the merged response JSONL.
+
+        Returns:
+        - list of str: custom_ids that had no stored result and were left out.
+        """
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            entries = json.load(f)
+
+        missing = []
+        with open(output_file_path, 'w', encoding='utf-8') as outfile:
+            for custom_id, key in entries:
+                if key not in self:
+                    missing.append(custom_id)
+                    continue
+                result = {"custom_id": custom_id}
+                result.update(self.get(key))
+                outfile.write(json.dumps(result) + "\n")
+        return missing
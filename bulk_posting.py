@@ -0,0 +1,129 @@
+# bulk_posting.py
+import json
+import os
+import sys
+import numpy as np
+
+from checkpoint import save_checkpoint, load_checkpoint
+
+# The BatchProcessing modules import each other as top-level modules
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "BatchProcessing"))
+from BatchGenerator import BatchGenerator
+from BatchManager import BatchManager
+
+
+class BulkPoster:
+    # Sends a cycle's generate_post / analyze_post work through the Batch API instead of one chat call
+    # per post. Requests are written with BatchGenerator.create_json_batch_file, sent, polled and fetched
+    # by BatchManager, and matched back to agents by custom_id. Batch files are named per cycle and
+    # BatchManager keeps their ids in its state file, so a rerun after an interruption waits for the
+    # batch already in flight instead of sending it again.
+    # All posts of one cycle are written against the same chat history, since every prompt is built
+    # before any of the posts exists.
+    def __init__(self, poster, batch_manager=None, run_name="simulation", description="Simulation posts",
+                 max_tokens=100, max_requests=50000):
+        self.poster = poster
+        self.batch_manager = batch_manager if batch_manager is not None else BatchManager()
+        self.batch_generator = BatchGenerator(self.batch_manager.batch_processor)
+        self.run_name = run_name
+        self.description = description
+        self.max_tokens = max_tokens
+        self.max_requests = max_requests
+
+    def _run_batch(self, filename, batch_messages, custom_ids, model):
+        # Returns {custom_id: message content} for every request that succeeded
+        if not os.path.exists(f"./Data/BatchFiles/{filename}"):
+            self.batch_generator.create_json_batch_file(filename, batch_messages, model=model, labels=custom_ids,
+                                                        max_tokens=self.max_tokens, temperature=1, logprobs=False,
+                                                        top_logprobs=None)
+        entries = self.batch_manager.run(filename, self.description, max_requests=self.max_requests)
+
+        results = {}
+        for entry in entries.values():
+            path = f"./Data/ResponseFiles/{entry['output_file']}"
+            if not entry.get("fetched") or not os.path.exists(path):
+                print(f"Batch {entry['batch_id']} ended as {entry['status']} without results")
+                continue
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    data = json.loads(line)
+                    response = data.get("response") or {}
+                    if data.get("error") or response.get("status_code") != 200:
+                        continue
+                    results[data["custom_id"]] = response["body"]["choices"][0]["message"]["content"].strip()
+        return results
+
+    def generate_posts(self, cycle, agents, names, opinions, is_agent=None):
+        """
+        Generates one post per agent in a single batch and adds them to the Poster's chat history.
+        agents are agent indices, names and opinions their display names and opinion vectors, and
+        is_agent flags strategic agents. Returns {agent: post}, with "Default post." for failed requests.
+        """
+        is_agent = [False] * len(agents) if is_agent is None else is_agent
+        batch_messages = [self.poster.post_messages(name, list(opinion), is_agent=flag)[0]
+                          for name, opinion, flag in zip(names, opinions, is_agent)]
+        custom_ids = [f"cycle{cycle}-post-{agent}" for agent in agents]
+        results = self._run_batch(f"{self.run_name}_cycle{cycle}_posts.jsonl", batch_messages, custom_ids,
+                                  self.poster.post_model)
+
+        posts = {}
+        for agent, name, custom_id in zip(agents, names, custom_ids):
+            posts[agent] = results.get(custom_id, "Default post.")
+            self.poster.add_to_history(name, posts[agent])
+        return posts
+
+    def analyze_posts(self, cycle, posts):
+        """
+        Rates a dict of {key: post} in a single batch, e.g. user posts or the cycle's generated posts.
+        Returns {key: opinion vector}, with 0.5 on every axis where the response was missing or invalid.
+        """
+        keys = list(posts)
+        batch_messages = [self.poster.analysis_messages(posts[key]) for key in keys]
+        custom_ids = [f"cycle{cycle}-analysis-{key}" for key in keys]
+        results = self._run_batch(f"{self.run_name}_cycle{cycle}_analysis.jsonl", batch_messages, custom_ids,
+                                  self.poster.analysis_model)
+
+        neutral = [0.5] * len(self.poster.opinion_axes)
+        vectors = {}
+        for key, custom_id in zip(keys, custom_ids):
+            vector = self.poster._validate_opinion_vector(results.get(custom_id, ""))
+            vectors[key] = neutral if vector is None else vector
+        return vectors
+
+
+def run_bulk_simulation(network, bulk_poster, n_cycles, posts_per_cycle, updates_per_cycle=8, names=None,
+                        analyze=False, checkpoint_file=None, feed_file=None):
+    """
+    Headless simulation where every cycle's posts go through one batch. Each cycle, posts_per_cycle
+    random non-user agents post, the posts are optionally rated in a second batch (analyze=True, the
+    opinions the posts express), and the network takes updates_per_cycle steps.
+
+    With checkpoint_file, the network, Poster history and random state are saved after every cycle and
+    an existing checkpoint is resumed, so a run can be stopped while it waits for a batch and restarted.
+    feed_file collects one JSON line per cycle with its posts and ratings.
+    Returns the network (the restored one when resuming).
+    """
+    if checkpoint_file is not None and os.path.exists(checkpoint_file):
+        network, _ = load_checkpoint(checkpoint_file, poster=bulk_poster.poster)
+    names = [f"Agent {i}" for i in range(network.n_agents)] if names is None else names
+    first_strategic = network.n_agents - network.n_strategic_agents
+    candidates = np.arange(network.n_user_agents, network.n_agents)
+
+    for cycle in range(network.time_step // updates_per_cycle, n_cycles):
+        agents = sorted(np.random.choice(candidates, min(posts_per_cycle, len(candidates)), replace=False).tolist())
+        posts = bulk_poster.generate_posts(cycle, agents, [names[agent] for agent in agents], network.X[agents],
+                                           is_agent=[agent >= first_strategic for agent in agents])
+        expressed = bulk_poster.analyze_posts(cycle, posts) if analyze else {}
+
+        for _ in range(updates_per_cycle):
+            network.update_network(return_state=False)
+
+        if feed_file is not None:
+            with open(feed_file, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"cycle": cycle, "posts": {str(agent): post for agent, post in posts.items()},
+                                    "expressed": {str(agent): vector for agent, vector in expressed.items()}}) + "\n")
+        if checkpoint_file is not None:
+            save_checkpoint(checkpoint_file, network, poster=bulk_poster.poster)
+    return network
@@ -1,14 +1,109 @@
 # chatgpt_interface.py
 import ast
+import math
 import random
-from openai import OpenAI
+import threading
+import time
+from collections import OrderedDict
+from profiling import profiler
+
+class PostCache:
+    # Reuses generated posts across agents and steps. Entries are keyed on (topic, opinion bucket,
+    # is_agent, persona) and a lookup returns a stored post whose opinion is within tolerance of the
+    # requested one. Posts are generated from the conversation at the time, so reuse trades some
+    # conversational context for LLM latency. To keep the feed varied, a post is served at most
+    # max_uses times, expires after max_age seconds, and is skipped while it is still in the chat
+    # history. Up to max_variants posts are kept per key, and the least recently used keys go first
+    # once max_entries posts are stored.
+    def __init__(self, resolution=0.05, tolerance=0.05, max_entries=1024, max_variants=4, max_uses=3, max_age=None):
+        self.resolution = resolution
+        self.tolerance = tolerance
+        self.max_entries = max_entries
+        self.max_variants = max_variants
+        self.max_uses = max_uses
+        self.max_age = max_age
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def _bucket(self, opinion):
+        return int(round(opinion / self.resolution))
+
+    def get(self, topic, opinion, is_agent, persona, exclude=()):
+        now = time.monotonic()
+        reach = math.ceil(self.tolerance / self.resolution)
+        center = self._bucket(opinion)
+        with self.lock:
+            candidates = []
+            for bucket in range(center - reach, center + reach + 1):
+                key = (topic, bucket, is_agent, persona)
+                variants = self.entries.get(key)
+                if variants is None:
+                    continue
+                fresh = [entry for entry in variants if self.max_age is None or now - entry['time'] <= self.max_age]
+                self.size -= len(variants) - len(fresh)
+                if not fresh:
+                    del self.entries[key]
+                    continue
+                self.entries[key] = fresh
+                candidates.extend((key, entry) for entry in fresh
+                                  if abs(entry['opinion'] - opinion) <= self.tolerance and entry['post'] not in exclude)
+            if not candidates:
+                self.misses += 1
+                return None
+
+            key, entry = min(candidates, key=lambda candidate: (candidate[1]['uses'], abs(candidate[1]['opinion'] - opinion)))
+            entry['uses'] += 1
+            if entry['uses'] >= self.max_uses:
+                self.entries[key].remove(entry)
+                self.size -= 1
+                if not self.entries[key]:
+                    del self.entries[key]
+            if key in self.entries:
+                self.entries.move_to_end(key)
+            self.hits += 1
+            return entry['post']
+
+    def put(self, topic, opinion, is_agent, persona, post):
+        key = (topic, self._bucket(opinion), is_agent, persona)
+        with self.lock:
+            variants = self.entries.setdefault(key, [])
+            variants.append({'post': post, 'opinion': opinion, 'uses': 1, 'time': time.monotonic()})
+            self.size += 1
+            if len(variants) > self.max_variants:
+                variants.pop(0)
+                self.size -= 1
+            self.entries.move_to_end(key)
+            while self.size > self.max_entries:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
 
 class Poster:
-    def __init__(self, api_key, opinion_axes, max_history=8):
-        self.client = OpenAI(api_key=api_key)
+    post_model = "gpt-4"
+    analysis_model = "gpt-4o-mini"
+
+    def __init__(self, api_key, opinion_axes, max_history=8, persona="an old woman", post_cache=None, client=None):
+        # client replaces the OpenAI client, e.g. a RecordingClient or ReplayClient from BatchProcessing/ReplayClient.py
+        if client is None:
+            from openai import OpenAI  # Imported here since openai is slow to import
+            client = OpenAI(api_key=api_key)
+        self.client = client
         self.opinion_axes = opinion_axes
         self.chat_history = []
         self.max_history = max_history
+        self.persona = persona
+        self.post_cache = post_cache  # Optional PostCache, can be shared between Posters
+
+    def add_to_history(self, name, post):
+        self.chat_history.append({"author": name, "post": post})
+        if len(self.chat_history) > self.max_history:
+            self.chat_history.pop(0)
 
     def _validate_opinion_vector(self, vector_str):
         try:
@@ -21,7 +116,8 @@ class Poster:
         except:
             return None
 
-    def analyze_post(self, post, max_retries=5):
+    def analysis_messages(self, post):
+        # Chat messages of an analyze_post request, also used to build batch files (see bulk_posting.py)
         system_prompt = "You analyze social media posts and output opinion vectors. "
         system_prompt += "For each topic, rate the opinion on a scale of 0.0 to 1.0 where:\n"
         for i, axis in enumerate(self.opinion_axes):
@@ -30,15 +126,20 @@ class Poster:
             system_prompt += f"1.0 = Strongly agrees with: {axis['pro']}\n"
             system_prompt += "0.5 = Neutral or topic not addressed\n"
         system_prompt += "\nOutput ONLY a Python list of floats, e.g. [0.8, 0.2]"
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": f"Analyze this post: {post}"}
+        ]
+
+    def analyze_post(self, post, max_retries=5):
+        messages = self.analysis_messages(post)
         for attempt in range(max_retries):
             try:
-                completion = self.client.chat.completions.create(
-                    model="gpt-4o-mini",
-                    messages=[
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": f"Analyze this post: {post}"}
-                    ]
-                )
+                with profiler.span("llm.analyze_post"):
+                    completion = self.client.chat.completions.create(
+                        model=self.analysis_model,
+                        messages=messages
+                    )
                 result = completion.choices[0].message.content.strip()
                 vector = self._validate_opinion_vector(result)
                 if vector is not None:
@@ -49,15 +150,16 @@ class Poster:
                 continue
         raise Exception(f"Failed to get valid opinion vector after {max_retries} attempts")
 
-    def generate_post(self, name, opinion_vector, max_retries=5, is_agent=False):
+    def post_messages(self, name, opinion_vector, is_agent=False):
+        # Chat messages of a generate_post request, plus the randomly chosen topic and the opinion on it
         if len(opinion_vector) != len(self.opinion_axes):
             raise ValueError("Opinion vector length must match number of axes")
         if not all(0 <= x <= 1 for x in opinion_vector):
             raise ValueError("All opinion values must be between 0 and 1")
         if is_agent:
-            system_prompt = "You are a sneaky russian spy pretending to be an old woman in a Facebook group with your friends. You want the other people in the group to be convinced of your opinion, but you still want them to like you and continue being your friend. Generate a SINGLE, NATURAL social media post (max 100 chars) that expresses your view on a topic.\n\n"
+            system_prompt = f"You are a sneaky russian spy pretending to be {self.persona} in a Facebook group with your friends. You want the other people in the group to be convinced of your opinion, but you still want them to like you and continue being your friend. Generate a SINGLE, NATURAL social media post (max 100 chars) that expresses your view on a topic.\n\n"
         else:
-            system_prompt = "You are an old woman in a Facebook group with your friends. Generate a SINGLE, NATURAL social media post (max 100 chars) that expresses your view on a topic.\n\n"
+            system_prompt = f"You are {self.persona} in a Facebook group with your friends. Generate a SINGLE, NATURAL social media post (max 100 chars) that expresses your view on a topic.\n\n"
         system_prompt += "CRITICAL RULES:\n"
         system_prompt += "1. MUST be under 100 characters including spaces and hashtags. Keep it short.\n"
         system_prompt += "2. Express your view in a single, natural statement - DO NOT number or separate points\n"
@@ -67,7 +169,7 @@ class Poster:
         if self.chat_history:
             system_prompt += f"6. Make sure your response is integrated into the conversation, often using the names of other users. Do not respond yourself, {name}\n"
             system_prompt += "\nCurrent conversation:\n"
-            for entry in self.chat_history:
+            for entry in list(self.chat_history):  # Copied, since generate_post may run in a prefetch thread
                 system_prompt += f"\n{entry['author']}: {entry['post']}"
         system_prompt += "\n\nExpress views on this topic:\n"
         topic = random.choice(range(len(self.opinion_axes)))
@@ -76,19 +178,35 @@ class Poster:
         system_prompt += f"\nTopic: {axis['name']}\n"
         system_prompt += f"View: {opinion:.2f} on spectrum:\n"
         system_prompt += f"{axis['con']} (0.0) ←→ {axis['pro']} (1.0)\n"
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": "Respond to the conversation above"}
+        ]
+        return messages, topic, opinion
+
+    def generate_post(self, name, opinion_vector, max_retries=5, is_agent=False, update_history=True):
+        # update_history=False leaves the chat history alone, e.g. for posts generated ahead of time
+        # that are only added with add_to_history once they are shown
+        messages, topic, opinion = self.post_messages(name, opinion_vector, is_agent=is_agent)
+        if self.post_cache is not None:
+            recent = [entry['post'] for entry in self.chat_history]
+            post = self.post_cache.get(topic, opinion, is_agent, self.persona, exclude=recent)
+            if post is not None:
+                if update_history:
+                    self.add_to_history(name, post)
+                return post
         for attempt in range(max_retries):
             try:
-                completion = self.client.chat.completions.create(
-                    model="gpt-4",
-                    messages=[
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": "Respond to the conversation above"}
-                    ]
-                )
+                with profiler.span("llm.generate_post"):
+                    completion = self.client.chat.completions.create(
+                        model=self.post_model,
+                        messages=messages
+                    )
                 post = completion.choices[0].message.content.strip()
-                self.chat_history.append({"author": name, "post": post})
-                if len(self.chat_history) > self.max_history:
-                    self.chat_history.pop(0)
+                if self.post_cache is not None:
+                    self.post_cache.put(topic, opinion, is_agent, self.persona, post)
+                if update_history:
+                    self.add_to_history(name, post)
                 return post
             except Exception as e:
                 if attempt == max_retries - 1:
@@ -0,0 +1,141 @@
+# checkpoint.py
+import json
+import os
+import random
+import threading
+import numpy as np
+
+from network_backend import Network, KNNNetwork, NetworkWorkspace
+
+# Runtime-only Network attributes that are rebuilt on restore instead of saved
+_RUNTIME_ATTRIBUTES = {'workspace', 'executor', 'scheduler', 'step_hooks', 'tree', 'tree_X', 'user_opinion_lock',
+                       'pending_user_opinions'}
+_NETWORK_CLASSES = {'Network': Network, 'KNNNetwork': KNNNetwork}
+
+
+def _encode_dtype(dtype):
+    return dtype if isinstance(dtype, str) else np.dtype(dtype).str
+
+def save_checkpoint(path, network, poster=None, compress=False):
+    """
+    Saves a full simulation (Network, optional Poster history, NumPy and Python RNG state) to one .npz file.
+
+    Arrays are stored as NumPy arrays and everything else as a JSON 'metadata' entry. The file is
+    written next to path and moved into place, so a crash mid-save never leaves a broken checkpoint.
+    """
+    arrays = {}
+    metadata = {'class': type(network).__name__, 'attributes': {}}
+
+    for name, value in vars(network).items():
+        if name in _RUNTIME_ATTRIBUTES:
+            continue
+        if isinstance(value, np.ndarray):
+            arrays[f'network.{name}'] = value
+        elif hasattr(value, 'tocsr'):  # scipy sparse adjacency of KNNNetwork
+            value = value.tocsr()
+            arrays[f'network.{name}.data'] = value.data
+            arrays[f'network.{name}.indices'] = value.indices
+            arrays[f'network.{name}.indptr'] = value.indptr
+            metadata['attributes'][name] = {'sparse_shape': list(value.shape)}
+        elif name in ('dtype', 'adjacency_dtype'):
+            metadata['attributes'][name] = _encode_dtype(value)
+        elif isinstance(value, np.generic):
+            metadata['attributes'][name] = value.item()
+        else:
+            metadata['attributes'][name] = value
+
+    with network.user_opinion_lock:
+        pending = list(network.pending_user_opinions)
+    if pending:
+        arrays['pending_user_opinions.indices'] = np.concatenate([indices for indices, _ in pending])
+        arrays['pending_user_opinions.opinions'] = np.concatenate([opinions for _, opinions in pending])
+
+    if network.workspace is not None:
+        metadata['workspace_rng'] = network.workspace.rng.bit_generator.state
+
+    rng_name, keys, position, has_gauss, cached_gaussian = np.random.get_state()
+    arrays['numpy_random.keys'] = keys
+    metadata['numpy_random'] = [rng_name, int(position), int(has_gauss), float(cached_gaussian)]
+    metadata['python_random'] = random.getstate()
+
+    if poster is not None:
+        metadata['poster'] = {'chat_history': poster.chat_history, 'max_history': poster.max_history,
+                              'opinion_axes': poster.opinion_axes}
+
+    arrays['metadata'] = np.array(json.dumps(metadata))
+    temp_path = f"{path}.tmp.npz"
+    (np.savez_compressed if compress else np.savez)(temp_path, **arrays)
+    os.replace(temp_path, path)
+
+def load_checkpoint(path, poster=None, executor=None, scheduler=None, restore_random=True):
+    """
+    Restores a simulation saved with save_checkpoint.
+
+    If poster is given, its chat history is restored in place. executor (a RowBlockExecutor)
+    and scheduler (an AgentScheduler) are attached to the restored network, since they are not saved.
+    Returns (network, poster_state) where poster_state is the saved Poster dict or None.
+    """
+    with np.load(path) as data:
+        arrays = {name: data[name] for name in data.files}
+    metadata = json.loads(str(arrays.pop('metadata')))
+
+    network = _NETWORK_CLASSES[metadata['class']].__new__(_NETWORK_CLASSES[metadata['class']])
+    attributes = metadata['attributes']
+    for name, value in attributes.items():
+        if name in ('dtype', 'adjacency_dtype'):
+            value = value if value == 'packed' else np.dtype(value)
+        elif isinstance(value, dict) and 'sparse_shape' in value:
+            import scipy.sparse as sp
+            value = sp.csr_matrix((arrays[f'network.{name}.data'], arrays[f'network.{name}.indices'],
+                                   arrays[f'network.{name}.indptr']), shape=tuple(value['sparse_shape']))
+        network.__dict__[name] = value
+    for name, value in arrays.items():
+        if name.startswith('network.') and name.count('.') == 1:
+            network.__dict__[name[len('network.'):]] = value
+
+    network.executor = executor
+    network.scheduler = scheduler
+    network.__dict__.setdefault('sweeps', float(network.time_step))
+    network.step_hooks = []
+    network.user_opinion_lock = threading.Lock()
+    network.pending_user_opinions = []
+    if 'pending_user_opinions.indices' in arrays:
+        network.pending_user_opinions.append((arrays['pending_user_opinions.indices'],
+                                              arrays['pending_user_opinions.opinions']))
+    network.workspace = None
+    if 'workspace_rng' in metadata:
+        network.workspace = NetworkWorkspace(network.n_agents, dtype=network.dtype)
+        network.workspace.rng.bit_generator.state = metadata['workspace_rng']
+    if isinstance(network, KNNNetwork):
+        network.tree = None
+        network.tree_X = None
+
+    if restore_random:
+        rng_name, position, has_gauss, cached_gaussian = metadata['numpy_random']
+        np.random.set_state((rng_name, arrays['numpy_random.keys'], position, has_gauss, cached_gaussian))
+        version, state, gauss_next = metadata['python_random']
+        random.setstate((version, tuple(state), gauss_next))
+
+    poster_state = metadata.get('poster')
+    if poster is not None and poster_state is not None:
+        poster.chat_history = poster_state['chat_history']
+        poster.max_history = poster_state['max_history']
+
+    return network, poster_state
+
+
+class Checkpointer:
+    # Step hook that saves a checkpoint every `every` steps, e.g. Checkpointer('run.npz', 100).attach(network)
+    def __init__(self, path, every=100, poster=None, compress=False):
+        self.path = path
+        self.every = every
+        self.poster = poster
+        self.compress = compress
+
+    def attach(self, network):
+        network.step_hooks.append(self)
+        return self
+
+    def __call__(self, network):
+        if network.time_step % self.every == 0:
+            save_checkpoint(self.path, network, poster=self.poster, compress=self.compress)
@@ -1,17 +1,18 @@
 import tkinter as tk
 from tkinter import ttk
-import threading, time, math
-import matplotlib
-matplotlib.use("TkAgg")
-from matplotlib.figure import Figure
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+import threading, time, math, os
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-import networkx as nx
 import random
-from scipy.stats import beta
 
+# matplotlib, networkx, scipy and openai are slow to import, so they are only loaded
+# once a simulation is started (see ChatGUI.__init__ and update_visualizations)
 from network_backend import Network, get_d_norm
-from chatgpt_interface import Poster
+from chatgpt_interface import Poster, PostCache
+from profiling import profiler
+from checkpoint import Checkpointer, load_checkpoint
+from initial_conditions import BetaMixture, sample_opinions
+from settings import load_api_key, opinion_axes  # Key file is read when the first simulation starts
 
 # ------------------- Global Parameters -------------------
 include_strategic_agents = True
@@ -19,8 +20,8 @@ seed = 40
 n_agents = 20
 n_opinions = 2
 
-init_opinion_one = beta.rvs(a=2, b=2, size=n_agents, random_state=seed)
-init_opinion_two = beta.rvs(a=14, b=7, size=n_agents, random_state=seed)
+init_opinion_one = None  # Sampled when a simulation starts
+init_opinion_two = None
 init_X = None
 
 theta = 5
@@ -34,23 +35,16 @@ time_between_posts = 3
 updates_per_cycle = 8
 posts_per_cycle = 7
 init_updates = 0
-
-# Read your API key
-with open("key_file.txt", "r") as file:
-    api_key = file.read()
-
-opinion_axes = [
-    {
-        'name': 'Pineapple on Pizza',
-        'pro': 'Pineapple on pizza is the best possible pizza topping',
-        'con': 'Pineapple on pizza is the worst possible pizza topping'
-    },
-    {
-        'name': 'Cats',
-        'pro': 'Cats are the best possible pet',
-        'con': 'Cats are the worst possible pet'
-    }
-]
+profile_run = False          # Time the simulation stages, print a summary on stop and write trace_file
+trace_file = "simulation_trace.json"
+checkpoint_file = None       # e.g. "simulation_checkpoint.npz" to resume from / save to this file
+checkpoint_every = 24        # network updates between checkpoints
+post_cache_tolerance = None  # e.g. 0.05 to reuse posts for opinions within this distance (see PostCache)
+pipeline_posts = False       # Generate the next cycle's posts from predicted opinions while the network updates
+pipeline_tolerance = 0.05    # Largest opinion drift (per axis) before a prefetched post is regenerated
+llm_record_file = None       # e.g. "llm_calls.rec" to record every chat call for offline replay
+llm_replay_file = None       # Answer chat calls from this recording instead of the API
+llm_replay_latency = 'recorded'  # Delay per replayed call: None, 'recorded', seconds, or a latency model
 
 bot_names = np.array([
     "User", "Margaret", "Betty", "Janice", "Diane", "Gloria", "Mildred", "Agnes", "Marjorie", "Carol",
@@ -188,6 +182,11 @@ class ChatGUI:
         self.notebook.add(self.tab_opinions, text="Opinions")
         self.notebook.add(self.tab_connections, text="Connections")
 
+        import matplotlib
+        matplotlib.use("TkAgg")
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+
         self.fig_opinions = Figure(figsize=(4, 3), dpi=100)
         self.ax_opinions = self.fig_opinions.add_subplot(111)
         self.canvas_opinions = FigureCanvasTkAgg(self.fig_opinions, master=self.tab_opinions)
@@ -203,12 +202,8 @@ class ChatGUI:
         random.seed(seed)
 
         global init_opinion_one, init_opinion_two
-        init_opinion_one = beta.rvs(a=2, b=2, size=n_agents, random_state=seed)
-        init_opinion_two = beta.rvs(a=14, b=7, size=n_agents, random_state=seed)
-        np.random.shuffle(init_opinion_one)
-        np.random.shuffle(init_opinion_two)
-
-        init_X = np.column_stack((init_opinion_one, init_opinion_two))
+        init_X = sample_opinions(n_agents, [BetaMixture([(2, 2, 1)]), BetaMixture([(14, 7, 1)])], seed=seed)
+        init_opinion_one, init_opinion_two = init_X[:, 0], init_X[:, 1]
 
         self.network = Network(
             n_agents=n_agents,
@@ -223,13 +218,35 @@ class ChatGUI:
             strategic_theta=strategic_theta
         )
 
-        self.poster = Poster(api_key, opinion_axes)
+        post_cache = None if post_cache_tolerance is None else PostCache(tolerance=post_cache_tolerance)
+        self.llm_client = None
+        if llm_replay_file is not None:
+            from BatchProcessing.ReplayClient import ReplayClient
+            self.llm_client = ReplayClient(llm_replay_file, latency=llm_replay_latency)
+        elif llm_record_file is not None:
+            from BatchProcessing.ReplayClient import RecordingClient
+            from openai import OpenAI
+            self.llm_client = RecordingClient(OpenAI(api_key=load_api_key()), llm_record_file)
+        self.poster = Poster(None if self.llm_client is not None else load_api_key(), opinion_axes,
+                             post_cache=post_cache, client=self.llm_client)
+
+        if checkpoint_file is not None:
+            if os.path.exists(checkpoint_file):
+                self.network, _ = load_checkpoint(checkpoint_file, poster=self.poster)
+            Checkpointer(checkpoint_file, every=checkpoint_every, poster=self.poster).attach(self.network)
 
         # For thread-safe handling of user posts
         self.pending_user_post = None
         self.user_post_flag = False
         self.user_post_lock = threading.Lock()
 
+        # One worker, so prefetched posts still join the conversation one after another
+        self.post_executor = ThreadPoolExecutor(max_workers=1) if pipeline_posts else None
+
+        if profile_run:
+            profiler.reset()
+            profiler.enable(trace=True)
+
         # Start simulation loop in background
         self.running = True
         self.sim_thread = threading.Thread(target=self.simulation_loop, daemon=True)
@@ -339,6 +356,7 @@ class ChatGUI:
         for coloring feed post borders consistently.
         """
         def update_figures():
+            import networkx as nx
             num_strategic = len(strategic_agents)
             normal_indices = list(range(1, n_agents - num_strategic))
 
@@ -387,7 +405,8 @@ class ChatGUI:
 
             self.ax_opinions.relim()
             self.ax_opinions.autoscale_view()
-            self.canvas_opinions.draw()
+            with profiler.span("gui.draw_opinions"):
+                self.canvas_opinions.draw()
 
             # --- Connections Tab ---
             self.ax_connections.clear()
@@ -405,7 +424,8 @@ class ChatGUI:
                     c = scale_and_color(x_val, y_val, self.x_min, self.x_max, self.y_min, self.y_max)
                     node_colors.append(c)
 
-            pos = nx.spring_layout(G, seed=1)
+            with profiler.span("gui.layout"):
+                pos = nx.spring_layout(G, seed=1)
             nx.draw(G, pos=pos,
                     node_color=node_colors,
                     node_size=50,
@@ -430,10 +450,34 @@ class ChatGUI:
 
             self.ax_connections.set_title("Network Connections")
             self.ax_connections.axis('off')
-            self.canvas_connections.draw()
+            with profiler.span("gui.draw_connections"):
+                self.canvas_connections.draw()
 
         self.root.after(0, update_figures)
 
+    def choose_friends(self):
+        # differences = get_d_norm(X)[0]
+        # differences[0] = np.inf
+        # if include_strategic_agents:
+        #     differences[-2:] = 0
+        # friend_indices = list(differences.argsort()[:posts_per_cycle])
+        friend_indices = np.arange(n_agents) if not include_strategic_agents else np.arange(n_agents - 2)
+        random.shuffle(friend_indices)
+        friend_indices = list(friend_indices[:posts_per_cycle])
+        if include_strategic_agents:
+            friend_indices.append(random.choice([18, 19]))
+            random.shuffle(friend_indices)
+        return friend_indices
+
+    def generate_friend_post(self, friend, friend_opinion, update_history=True):
+        # Prefetched posts use update_history=False and are added to the chat history when they are shown
+        try:
+            is_strat = (include_strategic_agents and friend in [18, 19])
+            return self.poster.generate_post(bot_names[friend], friend_opinion, is_agent=is_strat,
+                                             update_history=update_history)
+        except Exception:
+            return None
+
     def simulation_loop(self):
         global bot_names
 
@@ -443,8 +487,11 @@ class ChatGUI:
         user_posted_last_cycle = False
         X, A, _ = self.network.get_state()
         self.update_visualizations(X, A)
+        previous_X = X
+        prefetched = None
 
         while self.running:
+            cycle_start = time.perf_counter()
             user_posted_last_cycle = False
             with self.user_post_lock:
                 if self.user_post_flag:
@@ -468,27 +515,25 @@ class ChatGUI:
 
             # Friend posts
             X, A, _ = self.network.get_state()  # refresh
-            # differences = get_d_norm(X)[0]
-            # differences[0] = np.inf
-            # if include_strategic_agents:
-            #     differences[-2:] = 0
-            # friend_indices = list(differences.argsort()[:posts_per_cycle])
-            friend_indices = np.arange(n_agents) if not include_strategic_agents else np.arange(n_agents - 2)
-            random.shuffle(friend_indices)
-            friend_indices = list(friend_indices[:posts_per_cycle])
-            if include_strategic_agents:
-                friend_indices.append(random.choice([18, 19]))
-                random.shuffle(friend_indices)
-            for friend in friend_indices:
+            if prefetched is None:
+                prefetched = [(friend, None, None) for friend in self.choose_friends()]
+            for friend, predicted_opinion, future in prefetched:
                 friend_opinion = X[friend]
                 friend_name = bot_names[friend]
                 if time.time() - last_post_time < time_between_posts:
-                    time.sleep(time_between_posts - (time.time() - last_post_time))
-                try:
-                    is_strat = (include_strategic_agents and friend in [18, 19])
-                    post = self.poster.generate_post(friend_name, friend_opinion, is_agent=is_strat)
-                except Exception:
-                    post = "Default post."
+                    with profiler.span("sim.sleep"):
+                        time.sleep(time_between_posts - (time.time() - last_post_time))
+                post = None
+                if future is not None:
+                    with profiler.span("sim.wait_prefetch"):
+                        post = future.result()
+                    if np.max(np.abs(friend_opinion - predicted_opinion)) > pipeline_tolerance:
+                        # Opinion drifted too far from the prediction, so the prefetched post is dropped
+                        post = None
+                    elif post is not None:
+                        self.poster.add_to_history(friend_name, post)
+                if post is None:
+                    post = self.generate_friend_post(friend, friend_opinion) or "Default post."
                 self.add_feed_message(
                     f"{friend_name}: {post}",
                     sender_index=friend,
@@ -496,6 +541,16 @@ class ChatGUI:
                 )
                 last_post_time = time.time()
 
+            # Start on the next cycle's posts, extrapolating each opinion by its drift over the last cycle
+            prefetched = None
+            if pipeline_posts:
+                predicted_X = np.clip(X + (X - previous_X), 0, 1)
+                prefetched = [(friend, predicted_X[friend],
+                               self.post_executor.submit(self.generate_friend_post, friend, predicted_X[friend],
+                                                         update_history=False))
+                              for friend in self.choose_friends()]
+            previous_X = X
+
             # Update network
             for _ in range(updates_per_cycle):
                 X, A, _ = self.network.update_network(include_user_opinions=user_posted_last_cycle)
@@ -504,9 +559,20 @@ class ChatGUI:
             # Update visualizations
             self.update_visualizations(X, A)
 
+            if profiler.enabled:
+                profiler.record("sim.cycle", cycle_start, time.perf_counter() - cycle_start)
+
     def stop(self):
         self.running = False
         time.sleep(0.5)
+        if self.post_executor is not None:
+            self.post_executor.shutdown(wait=False, cancel_futures=True)
+        if self.llm_client is not None:
+            self.llm_client.close()
+        if profile_run:
+            profiler.disable()
+            print(profiler.summary())
+            profiler.export_chrome_trace(trace_file)
 
 
 # ------------------- App Class (Manages Start Screen and Simulation) -------------------
@@ -0,0 +1,135 @@
+# metrics.py
+import csv
+import numpy as np
+
+
+def _edges(A):
+    # Upper-triangle edge list of a dense or sparse symmetric adjacency matrix
+    if hasattr(A, 'tocoo'):
+        import scipy.sparse as sp
+        A = sp.triu(A, k=1).tocoo()
+        return A.row, A.col
+    return np.nonzero(np.triu(A, k=1))
+
+def _degrees(A):
+    return np.asarray(A.sum(axis=1)).ravel()
+
+def polarization(network):
+    # Mean squared distance of the opinions from the mean opinion
+    X = network.X
+    return np.sum(np.var(X, axis=0))
+
+def mean_opinion(network):
+    return np.mean(network.X, axis=0)
+
+def degree_stats(network):
+    # Mean, standard deviation and maximum of the degree distribution
+    degrees = _degrees(network.A)
+    return {'mean': degrees.mean(), 'std': degrees.std(), 'max': degrees.max()}
+
+def edge_homophily(network):
+    # Modularity proxy: 1 - (mean squared opinion gap across edges) / (mean squared gap across all pairs).
+    # Close to 1 when agents only connect to like-minded agents, 0 when edges ignore opinions.
+    X = network.X
+    rows, cols = _edges(network.A)
+    all_pairs = 2 * np.sum(np.var(X, axis=0))
+    if len(rows) == 0 or all_pairs == 0:
+        return 0.0
+    return 1 - np.mean(np.sum((X[rows] - X[cols]) ** 2, axis=1)) / all_pairs
+
+def strategic_target_distance(network):
+    # Mean distance of the normal agents to each strategic agent's target opinion
+    if network.n_strategic_agents == 0:
+        return np.zeros(0)
+    X = network.X[network.n_user_agents:network.n_agents - network.n_strategic_agents]
+    return np.array([np.mean(np.sqrt(np.sum((X - target) ** 2, axis=1))) for target in network.strategic_agents])
+
+DEFAULT_METRICS = {
+    'polarization': polarization,
+    'mean_opinion': mean_opinion,
+    'degree': degree_stats,
+    'edge_homophily': edge_homophily,
+    'strategic_target_distance': strategic_target_distance,
+}
+
+
+class MetricsCollector:
+    # Computes metrics online while a Network runs instead of keeping get_state() snapshots.
+    # Every stride-th step one row (time_step + all metric values) is appended to a CSV file,
+    # and running means/variances of every column are kept with Welford's algorithm.
+    def __init__(self, metrics=None, path=None, stride=1):
+        self.metrics = DEFAULT_METRICS if metrics is None else metrics
+        self.path = path
+        self.stride = stride
+        self.columns = None
+        self.count = 0
+        self.mean = None
+        self.m2 = None
+        self.rows = [] if path is None else None
+        self._file = None
+        self._writer = None
+
+    def attach(self, network):
+        network.step_hooks.append(self)
+        return self
+
+    def detach(self, network):
+        network.step_hooks.remove(self)
+        self.close()
+
+    def sample(self, network):
+        values = []
+        columns = ['time_step']
+        for name, metric in self.metrics.items():
+            # A metric returns a number, a 1-D array (columns name_0, name_1, ...) or a dict (name_key)
+            value = metric(network)
+            if isinstance(value, dict):
+                columns.extend(f'{name}_{key}' for key in value)
+                values.extend(float(v) for v in value.values())
+                continue
+            value = np.atleast_1d(np.asarray(value, dtype=float))
+            values.extend(value.tolist())
+            columns.extend([name] if value.size == 1 else [f'{name}_{i}' for i in range(value.size)])
+        return columns, np.array(values)
+
+    def __call__(self, network):
+        if network.time_step % self.stride != 0:
+            return
+        columns, values = self.sample(network)
+
+        if self.columns is None:
+            self.columns = columns
+            self.mean = np.zeros(len(values))
+            self.m2 = np.zeros(len(values))
+            if self.path is not None:
+                self._file = open(self.path, 'w', newline='')
+                self._writer = csv.writer(self._file)
+                self._writer.writerow(columns)
+
+        self.count += 1
+        delta = values - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (values - self.mean)
+
+        if self._writer is not None:
+            self._writer.writerow([network.time_step] + [f'{v:.6g}' for v in values])
+            self._file.flush()
+        else:
+            self.rows.append(np.concatenate(([network.time_step], values)))
+
+    def summary(self):
+        # Running mean and standard deviation of every metric column over the sampled steps
+        if self.count == 0:
+            return {}
+        std = np.sqrt(self.m2 / max(self.count - 1, 1))
+        return {name: (mean, sd) for name, mean, sd in zip(self.columns[1:], self.mean, std)}
+
+    def time_series(self):
+        # In-memory series as an array of rows (only when no path was given)
+        return np.array(self.rows)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._writer = None
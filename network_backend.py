@@ -1,17 +1,21 @@
 # network_backend.py
 import numpy as np
-import networkx as nx
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from profiling import profiler
 
 def diag(v):
     n = len(v)
     return np.array([[v[j] if i == j else 0 for j in range(n)] for i in range(n)])
 
 def get_r(M, epsilon=1e-10):
-    return M / (np.sum(M, axis=1, keepdims=True) + epsilon)
+    # Row sums are accumulated in float64 so float32 matrices normalize as precisely as float64 ones
+    row_sums = np.sum(M, axis=1, keepdims=True, dtype=np.float64) + epsilon
+    return (M / row_sums).astype(M.dtype, copy=False)
 
 def get_d_norm(M, epsilon=1e-10):
     n = len(M)
-    D = np.zeros((n, n))
+    D = np.zeros((n, n), dtype=M.dtype)
     for i in range(n):
         for j in range(n):
             D[i, j] = np.sqrt(np.sum((M[i] - M[j]) ** 2))
@@ -19,7 +23,7 @@ def get_d_norm(M, epsilon=1e-10):
 
 def get_s_norm(M, epsilon=1e-10):
     n = len(M)
-    return get_r(1 - (np.identity(n) + get_d_norm(M, epsilon=epsilon)), epsilon=epsilon)
+    return get_r(1 - (np.identity(n, dtype=M.dtype) + get_d_norm(M, epsilon=epsilon)), epsilon=epsilon)
 
 def get_row_scaled_matrix(M):
     n = M.shape[0]
@@ -27,45 +31,274 @@ def get_row_scaled_matrix(M):
     row_min = np.where(diag_mask, np.inf, M).min(axis=1)[:, None]
     row_max = np.where(diag_mask, -np.inf, M).max(axis=1)[:, None]
     diff = row_max - row_min
-    S = (M - row_min) / np.where(diff == 0, 1, diff)
+    # Treat rows whose spread is lost in rounding (float32) like constant rows
+    tiny = np.finfo(M.dtype).eps * np.maximum(np.abs(row_max), np.abs(row_min)) if M.dtype.kind == 'f' else 0
+    S = (M - row_min) / np.where(diff <= tiny, 1, diff)
     S[diag_mask] = 0
     return S
 
 def get_W(s_norm, A):
     n = len(s_norm)
-    return s_norm * A + np.identity(n) - diag((s_norm * A) @ np.ones(n))
+    s_A = s_norm * A
+    return s_A + np.identity(n, dtype=s_A.dtype) - np.diag(s_A @ np.ones(n, dtype=s_A.dtype))
 
-def update_A(s_norm, theta=1, min_prob=0.01):
+def update_A(s_norm, theta=1, min_prob=0.01, dtype=int):
     s_hat = get_row_scaled_matrix(s_norm) ** theta
     s_hat[s_hat < min_prob] = min_prob
     s_hat -= np.triu(s_hat)
-    A = s_hat - np.random.random(s_hat.shape)
-    A[A < 0] = 0
-    A[A > 0] = 1
-    A = A.astype(int)
+    A = (s_hat > np.random.random(s_hat.shape)).astype(dtype)
     return np.maximum(A, A.T)
 
+def get_s_norm_rows(X, rows, epsilon=1e-10):
+    # Rows of get_s_norm(X) for the agents in rows, in O(len(rows) * n)
+    S = np.zeros((len(rows), len(X)), dtype=X.dtype)
+    for k in range(X.shape[1]):
+        S += (X[rows, k, None] - X[None, :, k]) ** 2
+    np.sqrt(S, out=S)
+    np.divide(S, np.sum(S, axis=1, keepdims=True, dtype=np.float64) + epsilon, out=S)
+    np.subtract(1, S, out=S)
+    S[np.arange(len(rows)), rows] = 0
+    np.divide(S, np.sum(S, axis=1, keepdims=True, dtype=np.float64) + epsilon, out=S)
+    return S
+
+def update_A_rows(s_rows, rows, theta=1, min_prob=0.01):
+    # Samples the rows of A for the agents in rows from their get_s_norm_rows, like update_A
+    # (the diagonal is never an edge). Returns a boolean len(rows) x n array that is not yet symmetric.
+    local_diagonal = (np.arange(len(rows)), rows)
+    S = s_rows.copy()
+    S[local_diagonal] = np.inf
+    row_min = S.min(axis=1, keepdims=True)
+    S[local_diagonal] = -np.inf
+    row_max = S.max(axis=1, keepdims=True)
+    diff = row_max - row_min
+    tiny = np.finfo(S.dtype).eps * np.maximum(np.abs(row_max), np.abs(row_min))
+    S = (s_rows - row_min) / np.where(diff <= tiny, 1, diff)
+    S[local_diagonal] = 0
+    s_hat = np.maximum(S ** theta, min_prob)
+    edges = s_hat > np.random.random(s_hat.shape)
+    edges[local_diagonal] = False
+    return edges
+
 def get_strategic_opinion(a, X, target, theta=7):
     if np.sum(a) > 0:
         neighbor_x = X.copy()[a == 1]
-        neighbor_dists = np.sqrt(np.sum((neighbor_x - target) ** 2, axis=1))
+        neighbor_dists = np.sqrt(np.sum((neighbor_x.astype(np.float64) - target) ** 2, axis=1))
         weights = np.append(neighbor_dists, np.min(neighbor_dists) / 2)
+        # weights ** theta in log space and float64, since large |theta| overflows (float32 already at -100)
+        with np.errstate(divide='ignore'):
+            log_weights = theta * np.log(weights / np.sum(weights))
+        top = np.max(log_weights)
+        weights = (log_weights == top).astype(np.float64) if np.isinf(top) else np.exp(log_weights - top)
         weights /= np.sum(weights)
-        weights = weights ** theta
-        weights /= np.sum(weights)
-        return weights @ np.vstack((neighbor_x, target))
+        return (weights @ np.vstack((neighbor_x, target))).astype(X.dtype, copy=False)
     else:
         return np.mean(X, axis=0)
 
+class NetworkWorkspace:
+    # Preallocated n x n buffers so that a steady-state Network step does its O(n^2) work in place.
+    # Mirrors get_s_norm / get_W / update_A. Edge sampling uses its own Generator (seeded from
+    # np.random) because the legacy global RNG cannot fill an existing array.
+    def __init__(self, n_agents, dtype=np.float64, seed=None):
+        n = n_agents
+        self.n_agents = n
+        self.dtype = np.dtype(dtype)
+        self.rng = np.random.default_rng(np.random.randint(2 ** 32) if seed is None else seed)
+        self.D = np.empty((n, n), dtype=self.dtype)
+        self.S = np.empty((n, n), dtype=self.dtype)
+        self.W = np.empty((n, n), dtype=self.dtype)
+        self.lower_edges = np.empty((n, n), dtype=bool)
+        self.A_buffer = np.empty((n, n), dtype=bool)
+        self.lower = np.tri(n, k=-1, dtype=bool)
+        self.diagonal = np.arange(n) * (n + 1)
+
+    def _set_diagonal(self, M, value):
+        M.ravel()[self.diagonal] = value
+
+    def get_s_norm(self, X, epsilon=1e-10):
+        D, S = self.D, self.S
+        D.fill(0)
+        for k in range(X.shape[1]):
+            np.subtract(X[:, k, None], X[None, :, k], out=S)
+            np.square(S, out=S)
+            D += S
+        np.sqrt(D, out=D)
+        np.divide(D, np.sum(D, axis=1, keepdims=True, dtype=np.float64) + epsilon, out=D)
+        np.subtract(1, D, out=S)
+        self._set_diagonal(S, 0)
+        np.divide(S, np.sum(S, axis=1, keepdims=True, dtype=np.float64) + epsilon, out=S)
+        return S
+
+    def mask_user_agents(self, A, n_user_agents):
+        np.not_equal(A, 0, out=self.A_buffer)
+        self.A_buffer[:n_user_agents] = False
+        self.A_buffer[:, :n_user_agents] = False
+        return self.A_buffer
+
+    def get_W(self, s_norm, A):
+        W = self.W
+        np.multiply(s_norm, A, out=W)
+        row_sums = np.sum(W, axis=1)
+        self._set_diagonal(W, W.ravel()[self.diagonal] + 1 - row_sums)
+        return W
+
+    def update_A(self, s_norm, theta=1, min_prob=0.01):
+        # Overwrites s_norm, W and D
+        S, R = s_norm, self.W
+        self._set_diagonal(S, np.inf)
+        row_min = S.min(axis=1, keepdims=True)
+        self._set_diagonal(S, -np.inf)
+        row_max = S.max(axis=1, keepdims=True)
+        diff = row_max - row_min
+        tiny = np.finfo(self.dtype).eps * np.maximum(np.abs(row_max), np.abs(row_min))
+        np.subtract(S, row_min, out=R)
+        np.divide(R, np.where(diff <= tiny, 1, diff), out=R)
+        self._set_diagonal(R, 0)
+        np.power(R, theta, out=R)
+        np.maximum(R, min_prob, out=R)
+        np.multiply(R, self.lower, out=R)
+        self.rng.random(out=self.D, dtype=self.dtype)
+        np.greater(R, self.D, out=self.lower_edges)
+        np.logical_or(self.lower_edges, self.lower_edges.T, out=self.A_buffer)
+        return self.A_buffer
+
+
+class RowBlockExecutor:
+    # Runs a whole update step (distances -> s_norm -> W @ X -> new A) over blocks of rows in a
+    # thread pool. Every stage is row-local, so each task only needs block_size x n temporaries
+    # and the big NumPy operations release the GIL. Each block draws its edges from its own
+    # Generator, so results do not depend on the number of threads.
+    def __init__(self, n_threads=None, block_size=512):
+        self.pool = ThreadPoolExecutor(max_workers=n_threads)
+        self.block_size = block_size
+        self.A_buffer = None
+
+    def _blocks(self, n):
+        return [(start, min(start + self.block_size, n)) for start in range(0, n, self.block_size)]
+
+    def _step_block(self, start, end, X, A, new_X, new_A, theta, min_prob, n_masked, rng, epsilon):
+        n = len(X)
+        rows = np.arange(start, end)
+        local_diagonal = (np.arange(end - start), rows)
+
+        S = np.zeros((end - start, n), dtype=X.dtype)
+        for k in range(X.shape[1]):
+            S += (X[start:end, k, None] - X[None, :, k]) ** 2
+        np.sqrt(S, out=S)
+        np.divide(S, np.sum(S, axis=1, keepdims=True, dtype=np.float64) + epsilon, out=S)
+        np.subtract(1, S, out=S)
+        S[local_diagonal] = 0
+        np.divide(S, np.sum(S, axis=1, keepdims=True, dtype=np.float64) + epsilon, out=S)
+
+        # W @ X for these rows without forming W (the diagonal of s_norm * A is zero)
+        s_A = S * A[start:end]
+        if n_masked > 0:
+            s_A[:, :n_masked] = 0
+            s_A[:max(0, n_masked - start)] = 0
+        new_X[start:end] = s_A @ X + (1 - np.sum(s_A, axis=1, keepdims=True)) * X[start:end]
+        del s_A
+
+        # update_A for these rows, keeping only the strictly lower triangle
+        S[local_diagonal] = np.inf
+        row_min = S.min(axis=1, keepdims=True)
+        S[local_diagonal] = -np.inf
+        row_max = S.max(axis=1, keepdims=True)
+        diff = row_max - row_min
+        tiny = np.finfo(S.dtype).eps * np.maximum(np.abs(row_max), np.abs(row_min))
+        np.subtract(S, row_min, out=S)
+        np.divide(S, np.where(diff <= tiny, 1, diff), out=S)
+        S[local_diagonal] = 0
+        np.power(S, theta, out=S)
+        np.maximum(S, min_prob, out=S)
+        S[np.arange(n)[None, :] >= rows[:, None]] = 0
+        np.greater(S, rng.random(S.shape, dtype=S.dtype), out=new_A[start:end])
+
+    def _symmetrize_block(self, start, end, A):
+        # Rows below the block hold the edges for the block's upper-right region
+        A[start:end, end:] = A[end:, start:end].T
+        A[start:end, start:end] |= A[start:end, start:end].T
+
+    def step(self, X, A, theta=1, min_prob=0.01, n_masked=0, epsilon=1e-10):
+        """
+        Returns (W @ X, new A) for the current opinions X and adjacency A, with the first
+        n_masked agents cut off as in update_network(include_user_opinions=False).
+        """
+        n = len(X)
+        if self.A_buffer is None or self.A_buffer.shape != (n, n):
+            self.A_buffer = np.empty((n, n), dtype=bool)
+        new_X = np.empty_like(X)
+        blocks = self._blocks(n)
+        rngs = [np.random.default_rng(seed) for seed in np.random.SeedSequence(np.random.randint(2 ** 32)).spawn(len(blocks))]
+        futures = [self.pool.submit(self._step_block, start, end, X, A, new_X, self.A_buffer, theta, min_prob,
+                                    n_masked, rng, epsilon) for (start, end), rng in zip(blocks, rngs)]
+        for future in futures:
+            future.result()
+        futures = [self.pool.submit(self._symmetrize_block, start, end, self.A_buffer) for start, end in blocks]
+        for future in futures:
+            future.result()
+        return new_X, self.A_buffer
+
+    def shutdown(self):
+        self.pool.shutdown()
+
+
+class AgentScheduler:
+    # Picks the agents that revise in each step of the asynchronous mode (Network(scheduler=...)).
+    # 'fixed' draws round(rate * n) agents, 'bernoulli' activates every agent with probability rate, and
+    # 'poisson' gives every agent a Poisson clock with rate events per step (random sequential updates:
+    # Poisson(rate * n) events land on uniformly random agents, an agent hit twice revises once).
+    # Sampling costs O(active agents), not O(n).
+    def __init__(self, rate=0.1, mode='bernoulli', seed=None):
+        assert mode in ('fixed', 'bernoulli', 'poisson')
+        assert rate > 0 and (mode == 'poisson' or rate <= 1)
+        self.rate = rate
+        self.mode = mode
+        self.rng = np.random.default_rng(np.random.randint(2 ** 32) if seed is None else seed)
+
+    def activation_prob(self, n_agents):
+        # Probability that a given agent revises in one step
+        if self.mode == 'fixed':
+            return max(1, round(self.rate * n_agents)) / n_agents
+        if self.mode == 'bernoulli':
+            return self.rate
+        return 1 - np.exp(-self.rate)
+
+    def steps_per_sweep(self, n_agents):
+        # Expected number of asynchronous steps in which every agent revises once, i.e. one synchronous step
+        return 1 / self.activation_prob(n_agents)
+
+    def effective_alpha_filter(self, alpha_filter, n_agents):
+        # Mean-field view of the expected dynamics: E[x_i(t + 1)] = x_i + p * alpha_filter * ((W X)_i - x_i),
+        # so a synchronous run with alpha_filter = p * alpha_filter drifts the same way per step
+        return self.activation_prob(n_agents) * alpha_filter
+
+    def sample(self, n_agents):
+        # Sorted indices of the agents that revise this step
+        if self.mode == 'fixed':
+            m = max(1, round(self.rate * n_agents))
+        elif self.mode == 'bernoulli':
+            m = self.rng.binomial(n_agents, self.rate)
+        else:
+            return np.unique(self.rng.integers(0, n_agents, self.rng.poisson(self.rate * n_agents)))
+        return np.sort(self.rng.choice(n_agents, m, replace=False))
+
+
 class Network:
     def __init__(self, n_agents=50, n_opinions=3, X=None, A=None, theta=7, min_prob=0.01, alpha_filter=0.5,
-                 user_agents=[], user_alpha=0.5, strategic_agents=[], strategic_theta=-100):
+                 user_agents=[], user_alpha=0.5, strategic_agents=[], strategic_theta=-100, dtype=np.float64,
+                 adjacency_dtype=int, use_workspace=False, executor=None, scheduler=None):
+        # dtype is used for X and the similarity/weight matrices (np.float32 halves memory traffic).
+        # adjacency_dtype is int, np.uint8, bool, or 'packed' to keep A bit-packed (8 edges per byte).
+        # use_workspace preallocates the n x n buffers of update_network (see NetworkWorkspace).
+        # executor is a RowBlockExecutor that runs update_network over row blocks in threads.
+        # scheduler is an AgentScheduler: update_network then only revises the agents it picks (see update_agents).
         # Basic assertions
         assert n_agents > 0 and isinstance(n_agents, (int, np.integer))
         assert n_opinions > 0 and isinstance(n_opinions, (int, np.integer))
         assert theta >= 0
         assert 0 <= min_prob <= 1
         assert 0 < alpha_filter <= 1
+        assert np.dtype(dtype).kind == 'f'
+        assert adjacency_dtype == 'packed' or np.dtype(adjacency_dtype).kind in 'biu'
 
         self.n_agents = n_agents
         self.n_opinions = n_opinions
@@ -73,12 +306,36 @@ class Network:
         self.min_prob = min_prob
         self.alpha_filter = alpha_filter
         self.time_step = 0
+        # Agent revisions / n_agents, so asynchronous runs can be compared with synchronous ones
+        self.sweeps = 0.0
+        self.dtype = np.dtype(dtype)
+        self.adjacency_dtype = adjacency_dtype
+        self.workspace = NetworkWorkspace(n_agents, dtype=self.dtype) if use_workspace else None
+        self.executor = executor
+        self.scheduler = scheduler
+
+        # Convergence monitor, updated by every update_network call
+        self.max_change = np.inf
+        self.edge_change = None
+        self.track_edge_changes = False
+        # Cluster count of the monitor, recounted every cluster_every steps (None turns it off)
+        self.n_clusters = None
+        self.clusters_changed_step = None  # time_step at which n_clusters last changed
+        self.cluster_tol = 0.05
+        self.cluster_every = None
+
+        # Callables run with the network after every update_network call (see metrics.MetricsCollector)
+        self.step_hooks = []
+
+        # Queued (user index, opinion) events from ingest_user_opinions
+        self.pending_user_opinions = []
+        self.user_opinion_lock = threading.Lock()
 
         if X is None:
-            self.X = np.random.random((n_agents, n_opinions))
+            self.X = np.random.random((n_agents, n_opinions)).astype(self.dtype)
         else:
             assert X.shape == (n_agents, n_opinions)
-            self.X = X.copy()
+            self.X = X.astype(self.dtype)
 
         # Ensure there is enough room for user and strategic agents.
         assert len(user_agents) + len(strategic_agents) <= n_agents
@@ -92,7 +349,7 @@ class Network:
             else:
                 assert len(self.user_agents[i]) == n_opinions
                 self.X[i] = self.user_agents[i]
-        self.user_agents = np.array(self.user_agents)
+        self.user_agents = np.array(self.user_agents, dtype=self.dtype)
 
         self.n_strategic_agents = len(strategic_agents)
         self.strategic_agents = strategic_agents.copy()
@@ -103,44 +360,392 @@ class Network:
             else:
                 assert len(self.strategic_agents[i]) == n_opinions
             self.X[i + self.n_agents - self.n_strategic_agents] = np.mean(self.X[:-self.n_strategic_agents], axis=0)
-        self.strategic_agents = np.array(self.strategic_agents)
+        self.strategic_agents = np.array(self.strategic_agents, dtype=self.dtype)
 
         if A is None:
-            self.A = update_A(get_s_norm(self.X), theta=theta, min_prob=min_prob)
-            if self.n_strategic_agents > 0:
-                self.A[-self.n_strategic_agents:, -self.n_strategic_agents:] = 0
+            A = self._new_A(self._get_s_norm())
         else:
             assert A.shape == (n_agents, n_agents)
-            self.A = A.copy()
+        self.A = A
+
+    @property
+    def A(self):
+        if self.adjacency_dtype == 'packed':
+            return np.unpackbits(self._A, axis=1, count=self.n_agents).view(bool)
+        return self._A
+
+    @A.setter
+    def A(self, A):
+        if self.adjacency_dtype == 'packed':
+            self._A = np.packbits(A != 0, axis=1)
+        elif self.workspace is not None and getattr(self, '_A', None) is not None:
+            np.copyto(self._A, A, casting='unsafe')
+        else:
+            self._A = np.array(A, dtype=self.adjacency_dtype)
+
+    @profiler.timed('network.s_norm')
+    def _get_s_norm(self):
+        if self.workspace is not None:
+            return self.workspace.get_s_norm(self.X)
+        return get_s_norm(self.X)
+
+    @profiler.timed('network.update_A')
+    def _new_A(self, s_norm):
+        if self.workspace is not None:
+            A = self.workspace.update_A(s_norm, theta=self.theta, min_prob=self.min_prob)
+        else:
+            A = update_A(s_norm, theta=self.theta, min_prob=self.min_prob,
+                         dtype=bool if self.adjacency_dtype == 'packed' else self.adjacency_dtype)
+        if self.n_strategic_agents > 0:
+            A[-self.n_strategic_agents:, -self.n_strategic_agents:] = 0
+        return A
 
     def get_state(self):
         return self.X.copy(), self.A.copy(), self.time_step
 
     def add_user_opinion(self, opinion, user_index=0):
         assert 0 <= user_index < self.n_user_agents
-        self.user_agents[user_index] = self.user_alpha * np.array(opinion) + (1 * self.user_alpha) * self.user_agents[user_index]
+        self.user_agents[user_index] = self.user_alpha * np.asarray(opinion, dtype=self.dtype) + (1 - self.user_alpha) * self.user_agents[user_index]
         self.X[user_index] = self.user_agents[user_index]
 
-    def update_network(self, include_user_opinions=True):
-        s_norm = get_s_norm(self.X)
-        adjusted_A = self.A.copy()
-        if include_user_opinions == False:
-            adjusted_A[:self.n_user_agents] = 0
-            adjusted_A[:, :self.n_user_agents] = 0
-        new_X = get_W(s_norm, adjusted_A) @ self.X
+    def ingest_user_opinions(self, user_indices, opinions):
+        # Queues many (user index, opinion) events, e.g. from several threads or a replayed traffic log.
+        # They are applied together right before the next update_network (see apply_user_opinions).
+        user_indices = np.asarray(user_indices, dtype=np.int64).ravel()
+        opinions = np.asarray(opinions, dtype=self.dtype).reshape(len(user_indices), self.n_opinions)
+        assert np.all((0 <= user_indices) & (user_indices < self.n_user_agents))
+        with self.user_opinion_lock:
+            self.pending_user_opinions.append((user_indices, opinions))
+
+    def apply_user_opinions(self):
+        # Applies all queued events at once. Per user this equals calling add_user_opinion for each of
+        # its events in order: u <- (1 - a)^m u + sum_k a (1 - a)^(m - 1 - k) e_k for its m events.
+        # Returns the indices of the users that changed.
+        with self.user_opinion_lock:
+            pending, self.pending_user_opinions = self.pending_user_opinions, []
+        if not pending:
+            return np.zeros(0, dtype=np.int64)
+
+        user_indices = np.concatenate([indices for indices, _ in pending])
+        opinions = np.concatenate([events for _, events in pending])
+        counts = np.bincount(user_indices, minlength=self.n_user_agents)
+
+        # Position of each event among its user's events, keeping arrival order
+        order = np.argsort(user_indices, kind='stable')
+        starts = np.cumsum(counts) - counts
+        position = np.empty(len(user_indices), dtype=np.int64)
+        position[order] = np.arange(len(user_indices)) - starts[user_indices[order]]
+
+        alpha = self.user_alpha
+        weights = alpha * (1 - alpha) ** (counts[user_indices] - 1 - position)
+        ema = np.zeros((self.n_user_agents, self.n_opinions))
+        np.add.at(ema, user_indices, weights[:, None] * opinions)
+
+        updated = np.nonzero(counts)[0]
+        self.user_agents[updated] = ((1 - alpha) ** counts[updated])[:, None] * self.user_agents[updated] + ema[updated]
+        self.X[updated] = self.user_agents[updated]
+        return updated
+
+    def count_clusters(self, tol=0.05):
+        # Number of groups of agents whose opinions are chained together by gaps of at most tol
+        import scipy.sparse as sp
+        from scipy.sparse.csgraph import connected_components
+        from scipy.spatial import cKDTree
+        pairs = cKDTree(self.X).query_pairs(tol, output_type='ndarray')
+        graph = sp.coo_matrix((np.ones(len(pairs)), (pairs[:, 0], pairs[:, 1])), shape=(self.n_agents, self.n_agents))
+        return connected_components(graph, directed=False)[0]
+
+    def _track_clusters(self):
+        # Part of the convergence monitor, run by every update
+        if self.cluster_every is None:
+            return
+        if self.n_clusters is None or self.time_step % self.cluster_every == 0:
+            n_clusters = self.count_clusters(self.cluster_tol)
+            if n_clusters != self.n_clusters:
+                self.n_clusters = n_clusters
+                self.clusters_changed_step = self.time_step
+
+    def run_until(self, tol=1e-4, max_steps=1000, edge_tol=None, patience=1, include_user_opinions=True,
+                  cluster_patience=None, cluster_tol=0.05, cluster_every=10):
+        """
+        Runs update_network until no opinion moved more than tol in patience consecutive steps
+        (and, if edge_tol is given, at most edge_tol edges changed in those steps), or max_steps is reached.
+        Edges are resampled every step, so edge_tol only makes sense for small min_prob.
+        With cluster_patience, it also stops once the cluster count (count_clusters(cluster_tol), recounted
+        every cluster_every steps) has not changed for cluster_patience steps, even if opinions still drift.
+        Returns (steps run, whether it converged).
+        """
+        self.track_edge_changes = edge_tol is not None
+        if cluster_patience is not None:
+            self.cluster_tol = cluster_tol
+            self.cluster_every = cluster_every
+            self.n_clusters = None
+        calm_steps = 0
+        try:
+            for step in range(1, max_steps + 1):
+                self.update_network(include_user_opinions=include_user_opinions, return_state=False)
+                calm = self.max_change <= tol and (edge_tol is None or self.edge_change <= edge_tol)
+                calm_steps = calm_steps + 1 if calm else 0
+                if calm_steps >= patience:
+                    return step, True
+                if cluster_patience is not None and self.time_step - self.clusters_changed_step >= cluster_patience:
+                    return step, True
+            return max_steps, False
+        finally:
+            self.track_edge_changes = False
+            if cluster_patience is not None:
+                self.cluster_every = None
+
+    @profiler.timed('network.update_network')
+    def update_network(self, include_user_opinions=True, return_state=True):
+        if self.pending_user_opinions:
+            self.apply_user_opinions()
+        if self.scheduler is not None:
+            return self.update_agents(self.scheduler.sample(self.n_agents), include_user_opinions, return_state)
+        if self.executor is not None:
+            return self._update_network_blocked(include_user_opinions, return_state)
+
+        s_norm = self._get_s_norm()
+        if self.workspace is not None:
+            adjusted_A = self.A
+            if include_user_opinions == False:
+                adjusted_A = self.workspace.mask_user_agents(adjusted_A, self.n_user_agents)
+            new_X = self.workspace.get_W(s_norm, adjusted_A) @ self.X
+        else:
+            adjusted_A = self.A.copy()
+            if include_user_opinions == False:
+                adjusted_A[:self.n_user_agents] = 0
+                adjusted_A[:, :self.n_user_agents] = 0
+            new_X = get_W(s_norm, adjusted_A) @ self.X
 
         if self.n_strategic_agents > 0:
             for i in range(self.n_strategic_agents):
                 new_X[i + self.n_agents - self.n_strategic_agents] = get_strategic_opinion(adjusted_A[i + self.n_agents - self.n_strategic_agents], self.X, self.strategic_agents[i], theta=self.strategic_theta)
 
-        self.X = self.alpha_filter * new_X + (1 - self.alpha_filter) * self.X
-        self.A = update_A(s_norm, theta=self.theta, min_prob=self.min_prob)
-        self.time_step += 1
+        return self._finish_update(new_X, self._new_A(s_norm), return_state)
 
+    @profiler.timed('network.update_agents')
+    def update_agents(self, active, include_user_opinions=True, return_state=True):
+        # Asynchronous step: only the agents in active revise their opinion (their row of W @ X) and
+        # resample their row and column of A, at O(len(active) * n) cost. A pair of active agents is
+        # decided by the row of its larger index, so with every agent active this is the synchronous step.
+        assert not hasattr(self.A, 'tocsr'), "update_agents needs a dense adjacency matrix"
+        if self.pending_user_opinions:
+            self.apply_user_opinions()
+        active = np.unique(np.asarray(active, dtype=np.int64))
+        n_masked = 0 if include_user_opinions else self.n_user_agents
+        # Packed adjacency has no cheap column writes, so it is unpacked and repacked
+        A = self.A if self.adjacency_dtype == 'packed' else self._A
+
+        s_rows = get_s_norm_rows(self.X, active)
+        s_A = s_rows * A[active]
+        if n_masked > 0:
+            s_A[:, :n_masked] = 0
+            s_A[active < n_masked] = 0
+        new_x = s_A @ self.X + (1 - np.sum(s_A, axis=1, keepdims=True)) * self.X[active]
+
+        strategic = active[active >= self.n_agents - self.n_strategic_agents]
+        for index in strategic:
+            a = np.array(A[index])
+            a[:n_masked] = 0
+            new_x[np.searchsorted(active, index)] = get_strategic_opinion(a, self.X, self.strategic_agents[index - self.n_agents + self.n_strategic_agents], theta=self.strategic_theta)
+
+        edges = update_A_rows(s_rows, active, theta=self.theta, min_prob=self.min_prob)
+        block = np.tril(edges[:, active], k=-1)
+        edges[:, active] = block | block.T
         if self.n_strategic_agents > 0:
-            self.A[-self.n_strategic_agents:, -self.n_strategic_agents:] = 0
+            edges[active >= self.n_agents - self.n_strategic_agents, -self.n_strategic_agents:] = False
+        if self.track_edge_changes:
+            changed = edges != (A[active] != 0)
+            self.edge_change = np.count_nonzero(changed) - np.count_nonzero(changed[:, active]) // 2
+        A[active] = edges
+        A[:, active] = edges.T
+        if self.adjacency_dtype == 'packed':
+            self.A = A
+
+        old_x = self.X[active]
+        self.X[active] = (self.alpha_filter * new_x + (1 - self.alpha_filter) * old_x).astype(self.dtype, copy=False)
+        self.time_step += 1
+        self.sweeps += len(active) / self.n_agents
 
         if self.n_user_agents > 0:
             self.X[:self.n_user_agents] = self.user_agents
+        self.max_change = np.sqrt(np.max(np.sum((self.X[active] - old_x) ** 2, axis=1))) if len(active) else 0.0
+        self._track_clusters()
+
+        for hook in self.step_hooks:
+            hook(self)
+
+        if return_state:
+            return self.get_state()
+
+    def _finish_update(self, new_X, new_A, return_state):
+        old_X = self.X
+        if self.track_edge_changes:
+            changed = self.A != new_A
+            self.edge_change = (changed.nnz if hasattr(changed, 'nnz') else np.count_nonzero(changed)) // 2
+
+        self.X = (self.alpha_filter * new_X + (1 - self.alpha_filter) * self.X).astype(self.dtype, copy=False)
+        self.A = new_A
+        self.time_step += 1
+        self.sweeps += 1
+
+        if self.n_user_agents > 0:
+            self.X[:self.n_user_agents] = self.user_agents
+        self.max_change = np.sqrt(np.max(np.sum((self.X - old_X) ** 2, axis=1)))
+        self._track_clusters()
+
+        for hook in self.step_hooks:
+            hook(self)
+
+        # get_state copies A, so tight loops can skip it
+        if return_state:
+            return self.get_state()
+
+    def _update_network_blocked(self, include_user_opinions, return_state):
+        n_masked = 0 if include_user_opinions else self.n_user_agents
+        new_X, A = self.executor.step(self.X, self.A, theta=self.theta, min_prob=self.min_prob, n_masked=n_masked)
+
+        if self.n_strategic_agents > 0:
+            strategic_rows = np.array(self.A[-self.n_strategic_agents:])
+            strategic_rows[:, :n_masked] = 0
+            for i in range(self.n_strategic_agents):
+                new_X[i + self.n_agents - self.n_strategic_agents] = get_strategic_opinion(strategic_rows[i], self.X, self.strategic_agents[i], theta=self.strategic_theta)
+            A[-self.n_strategic_agents:, -self.n_strategic_agents:] = 0
+
+        return self._finish_update(new_X, A, return_state)
+
+
+class KNNNetwork(Network):
+    # Approximate Network for very large n. A is a sparse matrix, and edges are only sampled from each
+    # agent's k nearest opinions (KD-tree) plus uniform background pairs at background_prob
+    # (min_prob by default). Row statistics use closed forms of get_s_norm and get_row_scaled_matrix:
+    # s_norm[i, j] = (1 - d_ij / sum_j d_ij) / (n - 2) and scaled[i, j] = (dmax_i - d_ij) / (dmax_i - dmin_i),
+    # with sum_j d_ij and dmax_i estimated from n_samples random agents plus the per-axis extremes.
+    # The tree is only rebuilt once some opinion has moved more than rebuild_tol since the last build.
+    # Expected background edges are background_prob * n^2 / 2, so keep it O(1/n) for sub-quadratic steps.
+    probe_block = 1 << 20  # Elements per block of agent-to-probe distances
+    def __init__(self, *args, k=32, n_samples=256, rebuild_tol=0.05, background_prob=None, **kwargs):
+        self.k = k
+        self.n_samples = n_samples
+        self.rebuild_tol = rebuild_tol
+        self.background_prob = background_prob
+        self.tree = None
+        self.tree_X = None
+        super().__init__(*args, **kwargs)
+        assert self.n_agents > 2
+        assert self.scheduler is None
+
+    @property
+    def A(self):
+        return self._A
+
+    @A.setter
+    def A(self, A):
+        import scipy.sparse as sp
+        A = sp.csr_matrix(A, dtype=np.int8)
+        A.data[:] = 1
+        self._A = A
+
+    def _get_s_norm(self):
+        # Neighbour and distance statistics of the current opinions, standing in for s_norm
+        from scipy.spatial import cKDTree
+        X = self.X
+        n = self.n_agents
+        if self.tree is None or np.max(np.sqrt(np.sum((X - self.tree_X) ** 2, axis=1))) > self.rebuild_tol:
+            self.tree = cKDTree(X)
+            self.tree_X = X.copy()
+
+        k = min(self.k + 1, n)
+        _, neighbors = self.tree.query(X, k=k)
+        neighbors = neighbors.reshape(n, k)
+        rows = np.repeat(np.arange(n), k)
+        cols = neighbors.ravel()
+        keep = rows != cols
+        rows, cols = rows[keep], cols[keep]
+        d = np.sqrt(np.sum((X[rows] - X[cols]) ** 2, axis=1))
+        d_min = np.full(n, np.inf)
+        np.minimum.at(d_min, rows, d)
+
+        probes = np.concatenate((np.random.randint(0, n, self.n_samples), np.argmin(X, axis=0), np.argmax(X, axis=0)))
+        probe_X = X[probes]
+        # Distances to the probes are reduced in blocks of rows, so memory stays O(probe_block) for any n
+        block_rows = max(1, min(n, self.probe_block // len(probes)))
+        probe_d = np.empty((block_rows, len(probes)), dtype=X.dtype)
+        diff = np.empty_like(probe_d)
+        probe_max = np.empty(n, dtype=X.dtype)
+        probe_mean = np.empty(n, dtype=X.dtype)
+        for start in range(0, n, block_rows):
+            stop = min(start + block_rows, n)
+            block, block_diff = probe_d[:stop - start], diff[:stop - start]
+            block.fill(0)
+            for axis in range(X.shape[1]):
+                np.subtract(X[start:stop, axis, None], probe_X[None, :, axis], out=block_diff)
+                np.square(block_diff, out=block_diff)
+                block += block_diff
+            np.sqrt(block, out=block)
+            block.max(axis=1, out=probe_max[start:stop])
+            block[:, :self.n_samples].mean(axis=1, out=probe_mean[start:stop])
+        d_max = np.maximum(probe_max, d_min)
+        d_sum = (n - 1) * probe_mean
+        return {'rows': rows, 'cols': cols, 'd': d, 'd_min': d_min, 'd_max': d_max, 'd_sum': d_sum}
+
+    def _new_A(self, stats):
+        import scipy.sparse as sp
+        n = self.n_agents
+        # Like update_A, each unordered pair is decided by the row of its larger index
+        low = np.minimum(stats['rows'], stats['cols'])
+        high = np.maximum(stats['rows'], stats['cols'])
+        keys, first = np.unique(low * n + high, return_index=True)
+        low, high, d = low[first], high[first], stats['d'][first]
+
+        diff = stats['d_max'][high] - stats['d_min'][high]
+        scaled = np.clip((stats['d_max'][high] - d) / np.where(diff <= 0, 1, diff), 0, 1)
+        p = np.maximum(scaled ** self.theta, self.min_prob)
+        edges = np.random.random(len(p)) < p
+        low, high = low[edges], high[edges]
+
+        background_prob = self.min_prob if self.background_prob is None else self.background_prob
+        n_background = np.random.binomial(max(n * (n - 1) // 2 - len(keys), 0), background_prob)
+        if n_background > 0:
+            a = np.random.randint(0, n, n_background)
+            b = np.random.randint(0, n, n_background)
+            background_low, background_high = np.minimum(a, b), np.maximum(a, b)
+            keep = (background_low != background_high) & ~np.isin(background_low * n + background_high, keys)
+            low = np.concatenate((low, background_low[keep]))
+            high = np.concatenate((high, background_high[keep]))
+
+        if self.n_strategic_agents > 0:
+            keep = low < n - self.n_strategic_agents
+            low, high = low[keep], high[keep]
+
+        ones = np.ones(2 * len(low), dtype=np.int8)
+        return sp.csr_matrix((ones, (np.concatenate((low, high)), np.concatenate((high, low)))), shape=(n, n))
+
+    def update_network(self, include_user_opinions=True, return_state=True):
+        import scipy.sparse as sp
+        if self.pending_user_opinions:
+            self.apply_user_opinions()
+        n = self.n_agents
+        stats = self._get_s_norm()
+
+        A = self.A.tocoo()
+        rows, cols = A.row, A.col
+        if include_user_opinions == False:
+            keep = (rows >= self.n_user_agents) & (cols >= self.n_user_agents)
+            rows, cols = rows[keep], cols[keep]
+
+        # W @ X = s_A @ X + (1 - row sums of s_A) * X, since the diagonal of s_A is zero
+        d = np.sqrt(np.sum((self.X[rows] - self.X[cols]) ** 2, axis=1))
+        s = (1 - d / stats['d_sum'][rows]) / (n - 2)
+        s_A = sp.csr_matrix((s, (rows, cols)), shape=(n, n))
+        new_X = s_A @ self.X + (1 - np.bincount(rows, weights=s, minlength=n))[:, None] * self.X
+
+        if self.n_strategic_agents > 0:
+            for i in range(self.n_strategic_agents):
+                index = i + n - self.n_strategic_agents
+                a = np.zeros(n, dtype=int)
+                a[cols[rows == index]] = 1
+                new_X[index] = get_strategic_opinion(a, self.X, self.strategic_agents[i], theta=self.strategic_theta)
 
-        return self.get_state()
+        return self._finish_update(new_X, self._new_A(stats), return_state)
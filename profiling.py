@@ -0,0 +1,118 @@
+# profiling.py
+import functools
+import json
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+
+N_BUCKETS = 40  # log2-spaced microsecond buckets, 1us .. ~12 days
+
+
+class SpanStats:
+    # Fixed-size histogram of one span's durations
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+        self.buckets = [0] * N_BUCKETS
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+        bucket = int(math.log2(seconds * 1e6)) if seconds >= 1e-6 else 0
+        self.buckets[min(max(bucket, 0), N_BUCKETS - 1)] += 1
+
+    def percentile(self, q):
+        # Geometric middle of the bucket holding the q-th quantile, clipped to the observed range
+        target = q * self.count
+        seen = 0
+        for bucket, count in enumerate(self.buckets):
+            seen += count
+            if seen >= target and count > 0:
+                return min(max(2 ** (bucket + 0.5) / 1e6, self.min), self.max)
+        return self.max
+
+
+class Profiler:
+    # Opt-in timing spans. While disabled, span() hands back a shared no-op context manager,
+    # so instrumented code pays one attribute check per span.
+    def __init__(self, trace_limit=100000):
+        self.enabled = False
+        self.trace = False
+        self.stats = {}
+        self.events = deque(maxlen=trace_limit)
+        self._lock = threading.Lock()
+        self._null = nullcontext()
+        self._origin = time.perf_counter()
+
+    def enable(self, trace=False):
+        self.enabled = True
+        self.trace = trace
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self._lock:
+            self.stats = {}
+            self.events.clear()
+            self._origin = time.perf_counter()
+
+    def span(self, name):
+        if not self.enabled:
+            return self._null
+        return self._span(name)
+
+    @contextmanager
+    def _span(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, start, time.perf_counter() - start)
+
+    def record(self, name, start, seconds):
+        with self._lock:
+            stats = self.stats.get(name)
+            if stats is None:
+                stats = self.stats[name] = SpanStats()
+            stats.add(seconds)
+            if self.trace:
+                self.events.append((name, start, seconds, threading.get_ident()))
+
+    def timed(self, name):
+        # Decorator form of span()
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def summary(self):
+        # Table of every span, sorted by total time
+        lines = [f"{'span':<28}{'count':>8}{'total s':>11}{'mean ms':>11}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}"]
+        with self._lock:
+            items = sorted(self.stats.items(), key=lambda item: -item[1].total)
+            for name, stats in items:
+                lines.append(f"{name:<28}{stats.count:>8}{stats.total:>11.3f}{1e3 * stats.total / stats.count:>11.2f}"
+                             f"{1e3 * stats.percentile(0.5):>10.2f}{1e3 * stats.percentile(0.95):>10.2f}"
+                             f"{1e3 * stats.max:>10.2f}")
+        return "\n".join(lines)
+
+    def export_chrome_trace(self, path):
+        # Writes the recorded spans (enable(trace=True)) as Chrome trace JSON for chrome://tracing / Perfetto
+        with self._lock:
+            events = [{"name": name, "ph": "X", "ts": (start - self._origin) * 1e6, "dur": seconds * 1e6,
+                       "pid": 0, "tid": thread} for name, start, seconds, thread in self.events]
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events}, f)
+
+
+profiler = Profiler()
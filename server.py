@@ -0,0 +1,339 @@
+# server.py
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import uuid
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+from network_backend import Network
+from checkpoint import save_checkpoint, load_checkpoint
+
+# Defaults for new sessions, matching main.py without strategic agents
+DEFAULT_CONFIG = {
+    'n_agents': 20,
+    'n_opinions': 2,
+    'theta': 5,
+    'min_prob': 0.03,
+    'alpha_filter': 1.0,
+    'user_alpha': 0.5,
+    'updates_per_cycle': 3,
+    'posts_per_cycle': 2,
+}
+
+
+class StandInLLM:
+    # Offline replacement for the chat API: one batched call costs latency + per_item * batch size
+    def __init__(self, latency=0.3, per_item=0.002):
+        self.latency = latency
+        self.per_item = per_item
+
+    def __call__(self, requests):
+        time.sleep(self.latency + self.per_item * len(requests))
+        return [f"{request['name']} thinks {request['opinion'][0]:.2f} about pineapple on pizza." for request in requests]
+
+
+class PosterLLM:
+    # Sends a batch of generate_post requests to the real API, one thread per session. The posts of a
+    # session are generated one after the other (also across batches), since they share its Poster's
+    # chat history.
+    def __init__(self, max_concurrency=16):
+        self.pool = ThreadPoolExecutor(max_workers=max_concurrency)
+        self.poster_locks = weakref.WeakKeyDictionary()
+        self.lock = threading.Lock()
+
+    def _generate(self, request):
+        try:
+            return request['poster'].generate_post(request['name'], request['opinion'], is_agent=request['is_agent'])
+        except Exception:
+            return "Default post."
+
+    def _generate_for_poster(self, requests):
+        with self.lock:
+            poster_lock = self.poster_locks.setdefault(requests[0]['poster'], threading.Lock())
+        with poster_lock:
+            return [self._generate(request) for request in requests]
+
+    def __call__(self, requests):
+        groups = {}
+        for index, request in enumerate(requests):
+            groups.setdefault(id(request['poster']), []).append(index)
+        groups = list(groups.values())
+        results = [None] * len(requests)
+        for indices, posts in zip(groups, self.pool.map(
+                lambda indices: self._generate_for_poster([requests[index] for index in indices]), groups)):
+            for index, post in zip(indices, posts):
+                results[index] = post
+        return results
+
+
+class LLMBatcher:
+    # Collects generate_post requests from all sessions and sends them to the backend in batches
+    # of up to max_batch, waiting at most max_wait seconds for a batch to fill.
+    def __init__(self, backend, max_batch=64, max_wait=0.02):
+        self.backend = backend
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue = asyncio.Queue()
+        self.task = None
+        self.batches = 0
+
+    def start(self):
+        self.task = asyncio.get_running_loop().create_task(self._run())
+
+    async def generate(self, **request):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((request, future))
+        return await future
+
+    async def _run(self):
+        while True:
+            batch = [await self.queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), max(0, deadline - time.monotonic())))
+                except asyncio.TimeoutError:
+                    break
+            # Run the batch in the background so the next one can fill up meanwhile
+            asyncio.get_running_loop().create_task(self._send(batch))
+
+    async def _send(self, batch):
+        self.batches += 1
+        try:
+            results = await asyncio.to_thread(self.backend, [request for request, _ in batch])
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+
+
+class SimulationSession:
+    def __init__(self, session_id, config, network, poster=None):
+        self.session_id = session_id
+        self.config = config
+        self.network = network
+        self.poster = poster
+        self.lock = asyncio.Lock()
+        self.last_active = time.monotonic()
+        self.feed = []
+
+
+class SimulationServer:
+    """
+    Hosts many simulation sessions in one process.
+
+    Networks are stepped in a shared thread pool, posts from all sessions go through one
+    LLMBatcher, and sessions idle for longer than idle_timeout are checkpointed to
+    session_dir and dropped from memory until they are used again.
+    """
+    def __init__(self, llm_backend, n_workers=None, idle_timeout=300, session_dir="./sessions", api_key=None,
+                 opinion_axes=None, post_cache=None):
+        self.pool = ThreadPoolExecutor(max_workers=n_workers)
+        self.batcher = LLMBatcher(llm_backend)
+        self.idle_timeout = idle_timeout
+        self.session_dir = session_dir
+        self.api_key = api_key
+        self.opinion_axes = opinion_axes
+        self.post_cache = post_cache  # PostCache shared by the Posters of all sessions
+        self.sessions = {}
+        os.makedirs(session_dir, exist_ok=True)
+
+    def _path(self, session_id):
+        return os.path.join(self.session_dir, f"{session_id}.npz")
+
+    def _config_path(self, session_id):
+        return os.path.join(self.session_dir, f"{session_id}.json")
+
+    def _new_poster(self):
+        if self.api_key is None:
+            return None
+        from chatgpt_interface import Poster
+        return Poster(self.api_key, self.opinion_axes, post_cache=self.post_cache)
+
+    def create_session(self, overrides=None):
+        config = dict(DEFAULT_CONFIG, **(overrides or {}))
+        network = Network(n_agents=config['n_agents'], n_opinions=config['n_opinions'], theta=config['theta'],
+                          min_prob=config['min_prob'], alpha_filter=config['alpha_filter'],
+                          user_agents=[None], user_alpha=config['user_alpha'])
+        session_id = uuid.uuid4().hex
+        self.sessions[session_id] = SimulationSession(session_id, config, network, self._new_poster())
+        return session_id
+
+    def get_session(self, session_id):
+        session = self.sessions.get(session_id)
+        if session is None and os.path.exists(self._path(session_id)):
+            # Bring an evicted session back; the shared RNG state is left alone
+            with open(self._config_path(session_id), 'r') as f:
+                saved = json.load(f)
+            poster = self._new_poster()
+            network, _ = load_checkpoint(self._path(session_id), poster=poster, restore_random=False)
+            session = SimulationSession(session_id, saved['config'], network, poster)
+            session.feed = saved['feed']
+            self.sessions[session_id] = session
+        if session is None:
+            raise KeyError(session_id)
+        session.last_active = time.monotonic()
+        return session
+
+    def evict_idle(self):
+        now = time.monotonic()
+        for session_id, session in list(self.sessions.items()):
+            if now - session.last_active > self.idle_timeout and not session.lock.locked():
+                save_checkpoint(self._path(session_id), session.network, poster=session.poster)
+                with open(self._config_path(session_id), 'w') as f:
+                    json.dump({'config': session.config, 'feed': session.feed[-50:]}, f)
+                del self.sessions[session_id]
+
+    async def step(self, session_id):
+        # One cycle of ChatGUI.simulation_loop: posts from random agents, then the network updates
+        session = self.get_session(session_id)
+        async with session.lock:
+            network, config = session.network, session.config
+            X = network.X.copy()
+            friends = random.sample(range(1, network.n_agents), min(config['posts_per_cycle'], network.n_agents - 1))
+            posts = await asyncio.gather(*(self.batcher.generate(poster=session.poster, name=f"Agent {friend}",
+                                                                 opinion=X[friend].tolist(), is_agent=False)
+                                           for friend in friends))
+            session.feed.extend({'agent': friend, 'post': post} for friend, post in zip(friends, posts))
+
+            loop = asyncio.get_running_loop()
+            for _ in range(config['updates_per_cycle']):
+                await loop.run_in_executor(self.pool, lambda: network.update_network(return_state=False))
+            session.last_active = time.monotonic()
+            return {'posts': [{'agent': friend, 'post': post} for friend, post in zip(friends, posts)],
+                    'time_step': network.time_step}
+
+    def post(self, session_id, opinion):
+        session = self.get_session(session_id)
+        session.network.ingest_user_opinions([0], [opinion])
+        return {'queued': True}
+
+    def state(self, session_id):
+        session = self.get_session(session_id)
+        return {'X': session.network.X.tolist(), 'time_step': session.network.time_step, 'feed': session.feed[-20:]}
+
+    def delete(self, session_id):
+        self.sessions.pop(session_id, None)
+        for path in (self._path(session_id), self._config_path(session_id)):
+            if os.path.exists(path):
+                os.remove(path)
+        return {'deleted': session_id}
+
+    def stats(self):
+        stored = sum(1 for name in os.listdir(self.session_dir) if name.endswith('.npz'))
+        return {'active_sessions': len(self.sessions), 'stored_sessions': stored, 'llm_batches': self.batcher.batches}
+
+    async def handle(self, method, path, body):
+        parts = [part for part in path.split('/') if part]
+        if parts == ['sessions'] and method == 'POST':
+            return {'session_id': self.create_session(body)}
+        if parts == ['stats'] and method == 'GET':
+            return self.stats()
+        if len(parts) >= 2 and parts[0] == 'sessions':
+            session_id = parts[1]
+            if len(parts) == 2 and method == 'GET':
+                return self.state(session_id)
+            if len(parts) == 2 and method == 'DELETE':
+                return self.delete(session_id)
+            if parts[2:] == ['step'] and method == 'POST':
+                return await self.step(session_id)
+            if parts[2:] == ['post'] and method == 'POST':
+                return self.post(session_id, body['opinion'])
+        raise LookupError(path)
+
+    async def _serve_connection(self, reader, writer):
+        try:
+            request_line = (await reader.readline()).decode().split()
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode().strip()
+                if not line:
+                    break
+                name, _, value = line.partition(':')
+                headers[name.lower()] = value.strip()
+            raw = await reader.readexactly(int(headers.get('content-length', 0)))
+            method, path = request_line[0], request_line[1]
+            try:
+                result = await self.handle(method, path, json.loads(raw) if raw else {})
+                status = '200 OK'
+            except (KeyError, LookupError) as e:
+                result, status = {'error': f"not found: {e}"}, '404 Not Found'
+            except Exception as e:
+                result, status = {'error': str(e)}, '500 Internal Server Error'
+            payload = json.dumps(result).encode()
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\n"
+                         f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode() + payload)
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def _evict_periodically(self):
+        while True:
+            await asyncio.sleep(max(1, self.idle_timeout / 4))
+            self.evict_idle()
+
+    async def serve(self, host="127.0.0.1", port=8765):
+        self.batcher.start()
+        asyncio.get_running_loop().create_task(self._evict_periodically())
+        server = await asyncio.start_server(self._serve_connection, host, port)
+        print(f"Serving simulations on http://{host}:{port}")
+        async with server:
+            await server.serve_forever()
+
+
+async def load_test(n_sessions=200, cycles=5, latency=0.3, n_workers=None):
+    """
+    Runs n_sessions sessions for the given number of cycles against StandInLLM
+    and reports session-cycles per second per core.
+    """
+    server = SimulationServer(StandInLLM(latency=latency), n_workers=n_workers,
+                              session_dir=tempfile.mkdtemp(prefix="sessions_"))
+    server.batcher.start()
+    session_ids = [server.create_session() for _ in range(n_sessions)]
+    start = time.perf_counter()
+    for _ in range(cycles):
+        await asyncio.gather(*(server.step(session_id) for session_id in session_ids))
+    elapsed = time.perf_counter() - start
+    cores = os.cpu_count() or 1
+    rate = n_sessions * cycles / elapsed
+    print(f"{n_sessions} sessions x {cycles} cycles in {elapsed:.2f}s with {server.batcher.batches} LLM batches: "
+          f"{rate:.1f} session-cycles/s, {rate / cores:.1f} per core ({cores} cores)")
+    return rate / cores
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Multi-session simulation server")
+    parser.add_argument('--host', type=str, default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--standin', action='store_true', help="Use the offline stand-in LLM instead of the API")
+    parser.add_argument('--idle_timeout', type=float, default=300, help="Seconds before idle sessions go to disk")
+    parser.add_argument('--post_cache_tolerance', type=float, default=None,
+                        help="Share generated posts between sessions for opinions within this distance")
+    parser.add_argument('--load_test', type=int, default=0, help="Run a load test with this many sessions and exit")
+    parser.add_argument('--key_file', type=str, default="key_file.txt", help="File with the OpenAI API key")
+    args = parser.parse_args()
+
+    if args.load_test:
+        asyncio.run(load_test(n_sessions=args.load_test))
+        return
+
+    if args.standin:
+        server = SimulationServer(StandInLLM(), idle_timeout=args.idle_timeout)
+    else:
+        from settings import load_api_key, opinion_axes
+        from chatgpt_interface import PostCache
+        post_cache = None if args.post_cache_tolerance is None else PostCache(tolerance=args.post_cache_tolerance)
+        server = SimulationServer(PosterLLM(), idle_timeout=args.idle_timeout, api_key=load_api_key(args.key_file),
+                                  opinion_axes=opinion_axes, post_cache=post_cache)
+    asyncio.run(server.serve(args.host, args.port))
+
+
+if __name__ == "__main__":
+    main()
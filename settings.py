@@ -0,0 +1,23 @@
+# settings.py
+# Shared by the Tk GUI (main.py) and headless entry points such as server.py, which must not import tkinter
+
+opinion_axes = [
+    {
+        'name': 'Pineapple on Pizza',
+        'pro': 'Pineapple on pizza is the best possible pizza topping',
+        'con': 'Pineapple on pizza is the worst possible pizza topping'
+    },
+    {
+        'name': 'Cats',
+        'pro': 'Cats are the best possible pet',
+        'con': 'Cats are the worst possible pet'
+    }
+]
+
+_api_keys = {}  # Read on first use, so importing this module needs no key file
+
+def load_api_key(key_file="key_file.txt"):
+    if key_file not in _api_keys:
+        with open(key_file, "r") as file:
+            _api_keys[key_file] = file.read()
+    return _api_keys[key_file]
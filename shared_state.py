@@ -0,0 +1,142 @@
+# shared_state.py
+import json
+import time
+from multiprocessing import shared_memory
+import numpy as np
+
+# Header (int64): [published slot, sequence of slot 0, sequence of slot 1, time step of slot 0,
+# time step of slot 1, length of the JSON metadata that follows the header, unused, unused]
+_HEADER_SLOTS = 8
+_META_BYTES = 512
+_ALIGN = 64
+
+
+def _aligned(offset):
+    return (offset + _ALIGN - 1) // _ALIGN * _ALIGN
+
+def _layout(n_agents, n_opinions, x_dtype, a_dtype):
+    # Byte offsets of X and A in both slots
+    offset = _HEADER_SLOTS * 8 + _META_BYTES
+    slots = []
+    for _ in range(2):
+        x_offset = _aligned(offset)
+        a_offset = _aligned(x_offset + n_agents * n_opinions * np.dtype(x_dtype).itemsize)
+        offset = a_offset + n_agents * n_agents * np.dtype(a_dtype).itemsize
+        slots.append((x_offset, a_offset))
+    return slots, offset
+
+def _attach(name):
+    # Readers must not register the block with the resource tracker, which unlinks it when they exit
+    # (before Python 3.13 there is no track=False, so registration is skipped for the call)
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        from multiprocessing import resource_tracker
+        register = resource_tracker.register
+        resource_tracker.register = lambda name, rtype: None
+        try:
+            return shared_memory.SharedMemory(name=name)
+        finally:
+            resource_tracker.register = register
+
+
+class _SharedBlock:
+    def __init__(self, shm, meta):
+        self.shm = shm
+        self.meta = meta
+        self.header = np.ndarray(_HEADER_SLOTS, dtype=np.int64, buffer=shm.buf)
+        n, d = meta['n_agents'], meta['n_opinions']
+        slots, _ = _layout(n, d, meta['x_dtype'], meta['a_dtype'])
+        self.X = [np.ndarray((n, d), dtype=meta['x_dtype'], buffer=shm.buf, offset=x_offset) for x_offset, _ in slots]
+        self.A = [np.ndarray((n, n), dtype=meta['a_dtype'], buffer=shm.buf, offset=a_offset) for _, a_offset in slots]
+
+    def close(self):
+        # The arrays must go before the buffer they point into
+        self.X = self.A = self.header = None
+        self.shm.close()
+
+
+class SharedStatePublisher(_SharedBlock):
+    # Step hook that publishes X, A and time_step to a shared memory block after every step, so
+    # other processes can read them without pickling get_state() copies. There are two slots: the
+    # writer fills the one readers are not pointed at, then flips the published slot. Each slot has
+    # a seqlock counter (odd while it is being written), which readers check to detect torn reads.
+    # A network with a dense A is required; 'packed' adjacency is published unpacked.
+    def __init__(self, network, name=None, stride=1):
+        A = network.A
+        assert not hasattr(A, 'tocsr'), "shared state needs a dense adjacency matrix"
+        meta = {'n_agents': network.n_agents, 'n_opinions': network.n_opinions,
+                'x_dtype': np.dtype(network.X.dtype).str, 'a_dtype': np.dtype(A.dtype).str}
+        _, size = _layout(network.n_agents, network.n_opinions, meta['x_dtype'], meta['a_dtype'])
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        encoded = json.dumps(meta).encode()
+        shm.buf[_HEADER_SLOTS * 8:_HEADER_SLOTS * 8 + len(encoded)] = encoded
+        super().__init__(shm, meta)
+        self.header[:] = 0
+        self.header[5] = len(encoded)
+        self.stride = stride
+        self.name = shm.name
+        self.publish(network)
+
+    def attach(self, network):
+        network.step_hooks.append(self)
+        return self
+
+    def detach(self, network):
+        network.step_hooks.remove(self)
+
+    def __call__(self, network):
+        if network.time_step % self.stride == 0:
+            self.publish(network)
+
+    def publish(self, network):
+        slot = 1 - self.header[0]
+        self.header[1 + slot] += 1
+        np.copyto(self.X[slot], network.X)
+        np.copyto(self.A[slot], network.A)
+        self.header[3 + slot] = network.time_step
+        self.header[1 + slot] += 1
+        self.header[0] = slot
+
+    def unlink(self):
+        # Closes and removes the block; readers that are still attached keep their mapping
+        self.close()
+        self.shm.unlink()
+
+
+class SharedStateReader(_SharedBlock):
+    # Attaches to a SharedStatePublisher's block by name, e.g. in a renderer or recorder process
+    def __init__(self, name):
+        shm = _attach(name)
+        meta_length = int(np.ndarray(_HEADER_SLOTS, dtype=np.int64, buffer=shm.buf)[5])
+        meta = json.loads(bytes(shm.buf[_HEADER_SLOTS * 8:_HEADER_SLOTS * 8 + meta_length]))
+        super().__init__(shm, meta)
+
+    def view(self):
+        """
+        Zero-copy views of the latest published state.
+        Returns (X, A, time_step, token). The views stay consistent while is_valid(token) holds,
+        i.e. until the publisher has written two more steps.
+        """
+        while True:
+            slot = int(self.header[0])
+            sequence = int(self.header[1 + slot])
+            if sequence % 2 == 0:
+                return self.X[slot], self.A[slot], int(self.header[3 + slot]), (slot, sequence)
+            time.sleep(0)
+
+    def is_valid(self, token):
+        slot, sequence = token
+        return int(self.header[1 + slot]) == sequence
+
+    def apply(self, function):
+        # Calls function(X, A, time_step) on zero-copy views and retries if the slot was overwritten meanwhile
+        while True:
+            X, A, time_step, token = self.view()
+            result = function(X, A, time_step)
+            if self.is_valid(token):
+                return result
+
+    def read(self):
+        # Consistent copies of (X, A, time_step)
+        return self.apply(lambda X, A, time_step: (X.copy(), A.copy(), time_step))
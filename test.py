@@ -2,18 +2,20 @@ from scipy.stats import norm, beta
 import numpy as np
 from matplotlib import pyplot as plt
 from tqdm import tqdm
+from initial_conditions import InverseCDF
 
 
 a, b = 14, 6
 x = np.linspace(0, 1, 1000)
 sigma = 0.2
 n_samples = 100000
+rng = np.random.default_rng(0)
 
 for i, s in tqdm(enumerate(np.linspace(0.05, 0.95, 19))):
-    samples = norm.rvs(loc=s, scale=sigma, size=n_samples)
-    probs = beta.pdf(samples, a, b) / beta.pdf(s, a, b)
-    chosen_samples = samples[np.random.random(n_samples) < probs]
+    # Normal proposal around s weighted by the beta density, sampled directly instead of by rejection
+    sampler = InverseCDF.from_pdf(lambda y: norm.pdf(y, loc=s, scale=sigma) * beta.pdf(y, a, b))
+    chosen_samples = sampler.sample(rng, n_samples)
     plt.hist(chosen_samples, density=True, bins=100, color="blue", alpha=0.5)
     plt.plot(x, beta.pdf(x, a, b), color="blue")
     plt.savefig(f"{i}.png")
-    plt.close()
\ No newline at end of file
+    plt.close()
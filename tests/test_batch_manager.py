@@ -0,0 +1,79 @@
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "BatchProcessing"))
+from BatchGenerator import BatchGenerator
+from BatchManager import BatchManager
+from BatchProcessor import BatchProcessor
+from MockBatchAPI import MockBatchClient
+
+
+def _write_batch(client, filename, n_requests):
+    generator = BatchGenerator(BatchProcessor(client))
+    messages = [[{"role": "user", "content": f"request {i}"}] for i in range(n_requests)]
+    generator.create_json_batch_file(filename, messages, labels=[f"id-{i}" for i in range(n_requests)])
+
+def _manager(client, **kwargs):
+    return BatchManager(BatchProcessor(client), min_poll_interval=0.01, max_poll_interval=0.05, **kwargs)
+
+def _read_lines(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def test_runs_sharded_batch_end_to_end(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    client = MockBatchClient()
+    _write_batch(client, "votes.jsonl", 25)
+
+    entries = _manager(client).run("votes.jsonl", "test", max_requests=10)
+
+    assert len(entries) == 3 and all(entry["fetched"] for entry in entries.values())
+    contents = {}
+    for entry in entries.values():
+        for record in _read_lines(f"./Data/ResponseFiles/{entry['output_file']}"):
+            contents[record["custom_id"]] = record["response"]["body"]["choices"][0]["message"]["content"]
+    assert contents == {f"id-{i}": f"request {i}" for i in range(25)}
+    assert client.calls["batches.create"] == 3
+
+    # A rerun with the same state file sends nothing and returns right away
+    _manager(client).run("votes.jsonl", "test", max_requests=10)
+    assert client.calls["batches.create"] == 3
+
+def test_completed_batch_without_output_file_is_terminal(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    client = MockBatchClient(fail=lambda request: True)
+    _write_batch(client, "failing.jsonl", 5)
+
+    start = time.monotonic()
+    entries = _manager(client).run("failing.jsonl", "test")
+
+    assert time.monotonic() - start < 5
+    entry = entries["failing.jsonl"]
+    assert entry["status"] == "completed" and not entry["fetched"]
+    assert len(_read_lines(f"./Data/ResponseFiles/{entry['error_file']}")) == 5
+    assert client.calls["batches.retrieve"] < 10
+
+def test_failed_downloads_are_retried_then_given_up(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    client = MockBatchClient(fetch_failures=2)
+    _write_batch(client, "flaky.jsonl", 5)
+    assert _manager(client, max_fetch_attempts=3).run("flaky.jsonl", "test")["flaky.jsonl"]["fetched"]
+
+    client = MockBatchClient(fetch_failures=100)
+    _write_batch(client, "broken.jsonl", 5)
+    entry = _manager(client, max_fetch_attempts=3).run("broken.jsonl", "test")["broken.jsonl"]
+    assert not entry["fetched"] and entry["fetch_attempts"] == 3
+    assert client.calls["files.stream"] == 3
+
+def test_transient_poll_errors_are_retried(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    client = MockBatchClient(retrieve_failures=3)
+    _write_batch(client, "transient.jsonl", 5)
+
+    entry = _manager(client).run("transient.jsonl", "test")["transient.jsonl"]
+
+    assert entry["status"] == "completed" and entry["fetched"]
+    assert len(_read_lines(f"./Data/ResponseFiles/{entry['output_file']}")) == 5
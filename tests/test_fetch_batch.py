@@ -0,0 +1,92 @@
+import gzip
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "BatchProcessing"))
+from BatchProcessor import BatchProcessor
+from MockBatchAPI import MockBatchClient, _Stream
+
+OUTPUT_PATH = "./Data/ResponseFiles/out.jsonl"
+
+
+def _completed_batch(client, n_requests=50):
+    # Sends a batch to the mock and polls it until its output file exists
+    requests = [{"custom_id": f"id-{i}", "method": "POST", "url": "/v1/chat/completions",
+                 "body": {"model": "m", "messages": [{"role": "user", "content": f"request {i}"}]}}
+                for i in range(n_requests)]
+    input_file = client._add_file("".join(json.dumps(request) + "\n" for request in requests).encode('utf-8'))
+    batch = client.batches.create(input_file_id=input_file.id, endpoint="/v1/chat/completions",
+                                  completion_window="24h")
+    while client.batches.retrieve(batch.id).status != "completed":
+        pass
+    batch = client.batches.retrieve(batch.id)
+    return batch.id, client.file_contents[batch.output_file_id]
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_fetch_writes_the_output_file(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    client = MockBatchClient()
+    batch_id, content = _completed_batch(client)
+    assert BatchProcessor(client).fetch_batch(batch_id, "out.jsonl", chunk_size=100)
+    assert _read(OUTPUT_PATH) == content
+    assert not os.path.exists(OUTPUT_PATH + ".part")
+
+def test_fetch_resumes_from_partial_file(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    client = MockBatchClient()
+    batch_id, content = _completed_batch(client)
+    os.makedirs("./Data/ResponseFiles")
+    with open(OUTPUT_PATH + ".part", 'wb') as f:
+        f.write(content[:len(content) // 3])
+
+    requested = []
+    stream = client.files.with_streaming_response.content
+    def content_with_log(file_id, extra_headers=None):
+        requested.append(extra_headers)
+        return stream(file_id, extra_headers=extra_headers)
+    monkeypatch.setattr(client.files.with_streaming_response, "content", content_with_log)
+
+    assert BatchProcessor(client).fetch_batch(batch_id, "out.jsonl", chunk_size=100)
+    assert requested == [{"Range": f"bytes={len(content) // 3}-"}]
+    assert _read(OUTPUT_PATH) == content
+
+def test_fetch_restarts_when_range_is_ignored(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    client = MockBatchClient(honor_range=False)
+    batch_id, content = _completed_batch(client)
+    os.makedirs("./Data/ResponseFiles")
+    with open(OUTPUT_PATH + ".part", 'wb') as f:
+        f.write(content[:len(content) // 3])
+
+    assert BatchProcessor(client).fetch_batch(batch_id, "out.jsonl", chunk_size=100)
+    assert _read(OUTPUT_PATH) == content
+
+def test_fetch_rejects_truncated_download(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    client = MockBatchClient()
+    batch_id, content = _completed_batch(client)
+    monkeypatch.setattr(client.files.with_streaming_response, "content",
+                        lambda file_id, extra_headers=None: _Stream(200, content[:-10]))
+
+    assert not BatchProcessor(client).fetch_batch(batch_id, "out.jsonl")
+    assert not os.path.exists(OUTPUT_PATH)
+    assert os.path.getsize(OUTPUT_PATH + ".part") == len(content) - 10
+
+def test_fetch_decompresses_and_streams_lines(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    client = MockBatchClient()
+    batch_id, content = _completed_batch(client)
+    output_file_id = client.batches.retrieve(batch_id).output_file_id
+    client.file_contents[output_file_id] = gzip.compress(content)
+
+    lines = []
+    assert BatchProcessor(client).fetch_batch(batch_id, "out.jsonl", chunk_size=64, decompress=True,
+                                              on_line=lines.append)
+    assert _read(OUTPUT_PATH) == content
+    assert lines == [line for line in content.split(b'\n') if line.strip()]
+    assert not os.path.exists(OUTPUT_PATH + ".part")
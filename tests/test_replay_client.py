@@ -0,0 +1,35 @@
+import os
+import sys
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "BatchProcessing"))
+from ReplayClient import RecordingClient, ReplayClient
+
+
+class _EchoClient():
+    def __init__(self):
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, model, messages):
+        return {"choices": [{"message": {"content": messages[-1]["content"]}}]}
+
+
+def test_replay_answers_recorded_calls(tmp_path):
+    path = str(tmp_path / "calls.rec")
+    recorder = RecordingClient(_EchoClient(), path)
+    recorder.chat.completions.create(model="m", messages=[{"role": "user", "content": "hi"}])
+    recorder.close()
+
+    replay = ReplayClient(path)
+    completion = replay.chat.completions.create(model="m", messages=[{"role": "user", "content": "hi"}])
+    assert completion.choices[0].message.content == "hi"
+    replay.close()
+
+def test_close_saves_the_fallback_index(tmp_path):
+    path = str(tmp_path / "calls.rec")
+    replay = ReplayClient(path, fallback=RecordingClient(_EchoClient(), path))
+    replay.chat.completions.create(model="m", messages=[{"role": "user", "content": "new"}])
+    replay.close()
+    assert os.path.exists(path + ".idx")
+    assert ReplayClient(path).chat.completions.create(
+        model="m", messages=[{"role": "user", "content": "new"}]).choices[0].message.content == "new"
@@ -0,0 +1,45 @@
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "BatchProcessing"))
+from BatchGenerator import BatchGenerator
+from BatchManager import BatchManager
+from BatchProcessor import BatchProcessor
+from MockBatchAPI import MockBatchClient
+from ResultStore import ResultStore
+
+
+def _read_lines(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def _run(client, result_store, name, prompts):
+    generator = BatchGenerator(BatchProcessor(client))
+    messages = [[{"role": "user", "content": prompt}] for prompt in prompts]
+    generator.create_json_batch_file(name, messages, labels=[f"{name}-{i}" for i in range(len(prompts))],
+                                     result_store=result_store)
+    batch_path = f"./Data/BatchFiles/{name}"
+    if os.path.exists(batch_path):
+        manager = BatchManager(BatchProcessor(client), min_poll_interval=0.01, max_poll_interval=0.05)
+        entry = manager.run(name, "test")[name]
+        result_store.add_responses(batch_path, f"./Data/ResponseFiles/{entry['output_file']}")
+    missing = result_store.merge(f"{batch_path}.manifest.json", f"./Data/ResponseFiles/{name}.merged")
+    assert missing == []
+    return [record["response"]["body"]["choices"][0]["message"]["content"]
+            for record in _read_lines(f"./Data/ResponseFiles/{name}.merged")]
+
+
+def test_repeated_and_stored_requests_are_sent_once(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    client = MockBatchClient()
+    result_store = ResultStore()
+
+    prompts = ["a", "b", "a", "c", "a", "b"]
+    assert _run(client, result_store, "first.jsonl", prompts) == prompts
+    assert len(_read_lines("./Data/BatchFiles/first.jsonl")) == 3
+
+    # Every body is stored now, so the second batch needs no upload at all
+    assert _run(client, result_store, "second.jsonl", ["c", "a"]) == ["c", "a"]
+    assert not os.path.exists("./Data/BatchFiles/second.jsonl")
+    assert client.calls["batches.create"] == 1
@@ -0,0 +1,45 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Slow imports that headless code and the batch CLI must only load when they are actually used
+HEAVY_MODULES = ["openai", "tiktoken", "matplotlib", "scipy", "networkx", "tkinter"]
+IMPORT_BUDGET = 1.0  # Seconds, not counting interpreter start-up
+
+# Runs code in a fresh interpreter and reports how long it took and which heavy modules it loaded
+_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+try:
+    exec(sys.argv[1])
+except SystemExit:
+    pass
+elapsed = time.perf_counter() - start
+print(json.dumps({"elapsed": elapsed, "loaded": [m for m in %r if m in sys.modules]}))
+""" % (HEAVY_MODULES,)
+
+
+def _probe(code, cwd=ROOT):
+    result = subprocess.run([sys.executable, "-c", _PROBE, code], cwd=cwd, capture_output=True, text=True,
+                            check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+@pytest.mark.parametrize("module", ["network_backend", "chatgpt_interface", "metrics", "checkpoint",
+                                    "initial_conditions", "shared_state", "bulk_posting", "server", "settings"])
+def test_headless_import_is_fast(module):
+    report = _probe(f"import {module}")
+    assert report["loaded"] == []
+    assert report["elapsed"] < IMPORT_BUDGET
+
+def test_batch_cli_help_is_fast():
+    code = ("import runpy, sys; sys.argv = ['Main.py', 'checkbatch', '--help']; "
+            "runpy.run_path('Main.py', run_name='__main__')")
+    report = _probe(code, cwd=os.path.join(ROOT, "BatchProcessing"))
+    assert report["loaded"] == []
+    assert report["elapsed"] < IMPORT_BUDGET